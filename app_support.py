@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Helpers shared by the orchestrator API and the web dashboard
+- Optional orjson-backed Flask JSON provider
+- Loggers that write through a QueueListener thread
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson  # optional: faster JSON responses when installed
+except ImportError:
+    orjson = None
+
+json_loads = orjson.loads if orjson is not None else json.loads
+json_dumps = orjson.dumps if orjson is not None else (lambda obj: json.dumps(obj).encode())
+
+
+class ORJSONProvider(DefaultJSONProvider):
+    """Serialise responses with orjson, falling back to the stdlib for anything it rejects"""
+
+    def dumps(self, obj, **kwargs):
+        try:
+            return orjson.dumps(obj).decode()
+        except TypeError:
+            return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Hand orjson's bytes straight to the response instead of
+        # decoding to str only for Werkzeug to encode it again
+        try:
+            body = orjson.dumps(self._prepare_response_obj(args, kwargs))
+        except TypeError:
+            return super().response(*args, **kwargs)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def install_json_provider(app):
+    """Use ORJSONProvider for app when orjson is installed"""
+    if orjson is not None:
+        app.json = ORJSONProvider(app)
+
+
+def queue_logger(name, level=logging.INFO):
+    """Logger whose callers only enqueue records; a listener thread writes them to stdout"""
+    log = logging.getLogger(name)
+    log.setLevel(level)
+    log.propagate = False
+    q = queue.Queue(-1)
+    log.addHandler(logging.handlers.QueueHandler(q))
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(logging.Formatter("%(message)s"))
+    listener = logging.handlers.QueueListener(q, stream)
+    listener.start()
+    atexit.register(listener.stop)
+    return log
@@ -15,7 +15,7 @@ def should_run_optimization():
     """Check if optimization flag is enabled in config."""
     try:
         with open(CONFIG_FILE, 'r') as f:
-            config = yaml.safe_load(f)
+            config = yaml.load(f, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
         
         return config.get('rotation', {}).get('run_optimization', False)
     except Exception as e:
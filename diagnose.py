@@ -19,7 +19,7 @@ def check_config():
     
     try:
         with open(config_file, 'r') as f:
-            config = yaml.safe_load(f)
+            config = yaml.load(f, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
         print(f"✅ config.yaml found")
         print(f"   LAN IP: {config.get('lan_bind_ip', 'Not set')}")
         print(f"   API Port: {config.get('api', {}).get('port', 'Not set')}")
@@ -95,20 +95,27 @@ def check_ip_history():
     """Check IP history file"""
     print("\n🔍 Checking IP history...")
     
-    history_file = Path("state/ip_history.json")
+    history_file = Path("state/ip_history.jsonl")
     if history_file.exists():
         try:
             import json
+            # Header line {"first_seen", "dropped"}, then one entry per line
+            header, ips = {}, []
             with open(history_file, 'r') as f:
-                history = json.load(f)
+                for line in f:
+                    if line.strip():
+                        rec = json.loads(line)
+                        if 'ip' in rec:
+                            ips.append(rec)
+                        else:
+                            header = rec
             print(f"✅ IP history file found")
-            print(f"   Total rotations: {history.get('rotations', 0)}")
-            print(f"   IPs recorded: {len(history.get('ips', []))}")
-            if history.get('first_seen'):
-                print(f"   First seen: {history['first_seen']}")
+            print(f"   Total rotations: {max(0, header.get('dropped', 0) + len(ips) - 1)}")
+            print(f"   IPs recorded: {len(ips)}")
+            if header.get('first_seen'):
+                print(f"   First seen: {header['first_seen']}")
             
             # Show recent IPs
-            ips = history.get('ips', [])
             if ips:
                 print("   Recent IPs:")
                 for ip in ips[-3:]:  # Last 3 IPs
@@ -18,6 +18,7 @@ import socket
 import time
 import json
 import secrets
+import shutil
 import subprocess
 from pathlib import Path
 
@@ -641,6 +642,18 @@ dns_nameservers 8.8.8.8 1.1.1.1
     run_cmd(["sudo", "chmod", "644", str(BASE / "squid.conf")], check=False)
     print("  ✅ squid.conf ready")
 
+def web_app_entry():
+    """PM2 script/interpreter/args for the dashboard: gunicorn (gthread) when installed"""
+    gunicorn = shutil.which("gunicorn")
+    if gunicorn:
+        # One worker so the in-process caches and the SSE watcher are shared;
+        # threads keep a long /api/rotate from blocking other requests
+        return (f'script: "{gunicorn}",\n'
+                f'      args: "-w 1 -k gthread --threads 8 -b 0.0.0.0:5000 web_interface:app",\n'
+                f'      interpreter: "none",')
+    return ('script: "web_interface.py",\n'
+            '      interpreter: "python3",')
+
 def write_ecosystem():
     eco = BASE / "ecosystem.config.js"
     content = f"""module.exports = {{
@@ -659,8 +672,7 @@ def write_ecosystem():
     }},
     {{
       name: "4g-proxy-web",
-      script: "web_interface.py",
-      interpreter: "python3",
+      {web_app_entry()}
       cwd: "{BASE.as_posix()}",
       autorestart: true,
       max_restarts: 10,
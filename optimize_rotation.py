@@ -33,7 +33,7 @@ CONTROL_CHECK_INTERVAL = 300  # Check every 5 minutes
 
 def load_config():
     with open(CONFIG_FILE, 'r') as f:
-        return yaml.safe_load(f)
+        return yaml.load(f, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
 
 def save_config(config):
     with open(CONFIG_FILE, 'w') as f:
@@ -1,18 +1,39 @@
 #!/usr/bin/env python3
 import os
 import sys
+import atexit
+import glob
 import time
+import select
+import socket
+import struct
+import fcntl
 import requests
 import serial
 import yaml
 import json
 import subprocess
 import threading
+import queue
+import ipaddress
+from collections import deque
+import hmac
 from flask import Flask, request, jsonify, abort
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
 
+from app_support import install_json_provider, queue_logger
+
 app = Flask(__name__)
+install_json_provider(app)
+
+# Rotation progress is logged through a queue so the rotating thread never
+# blocks on stdout; the listener thread does the actual writes
+log = queue_logger("rotate")
 
 # ========= Paths & helpers =========
 
@@ -31,30 +52,133 @@ PPPD_PATH      = which("pppd", "/usr/sbin/pppd")
 IP_PATH        = which("ip", "/usr/sbin/ip")
 SYSTEMCTL_PATH = which("systemctl", "/bin/systemctl")
 MMCLI_PATH     = which("mmcli", "/usr/bin/mmcli")
+IPTABLES_RESTORE_PATH = which("iptables-restore", "/usr/sbin/iptables-restore")
+
+# Prebuilt argv for the link up/down calls made on every rotation;
+# slots 6 and 7 are filled with the interface and state per call
+LINK_SET_TEMPLATE = [SUDO_PATH, "-n", IP_PATH, "link", "set", "dev", None, None]
+_MINIMAL_ENV = {"PATH": os.environ.get("PATH", "/usr/sbin:/usr/bin:/sbin:/bin"), "LANG": "C"}
+
+# Fixed argv used on the rotation path, built once at import
+PPP_KILL_CMD           = (SUDO_PATH, "-n", PKILL_PATH, "pppd")
+PPP_CALL_CMD           = (SUDO_PATH, "-n", PPPD_PATH, "call", "ee")
+ROUTE_SHOW_DEFAULT_CMD = (IP_PATH, "-j", "route", "show", "default")
+PPP_SECONDARY_ROUTE_CMD = (SUDO_PATH, "-n", IP_PATH, "route", "add", "default", "dev", "ppp0", "metric", "600")
+MM_START_CMD   = (SUDO_PATH, "-n", SYSTEMCTL_PATH, "start", "ModemManager")
+MM_STOP_CMD    = (SUDO_PATH, "-n", SYSTEMCTL_PATH, "stop", "ModemManager")
+MM_DISABLE_CMD = (SUDO_PATH, "-n", MMCLI_PATH, "-m", "0", "--disable")
+MM_ENABLE_CMD  = (SUDO_PATH, "-n", MMCLI_PATH, "-m", "0", "--enable")
+
+def link_set(iface, state):
+    argv = LINK_SET_TEMPLATE.copy()
+    argv[6] = iface
+    argv[7] = state
+    return subprocess.run(argv, capture_output=True, text=True, check=False, env=_MINIMAL_ENV)
+
+# One keep-alive pool for outbound HTTPS (ipify lookups, Discord webhook);
+# only connection-level failures are retried, so POST/PATCH aren't resent
+http_session = requests.Session()
+http_session.mount("https://", HTTPAdapter(pool_maxsize=4, max_retries=Retry(total=2, read=0, backoff_factor=0.3)))
 
 # ========= State files =========
 
 STATE_DIR = Path(__file__).parent / "state"
 STATE_DIR.mkdir(exist_ok=True)
 MSG_ID_PATH = STATE_DIR / "discord_message_id.txt"
-IP_HISTORY_PATH = STATE_DIR / "ip_history.json"
+IP_HISTORY_PATH = STATE_DIR / "ip_history.jsonl"
+LEGACY_IP_HISTORY_PATH = STATE_DIR / "ip_history.json"
 ORIGINAL_IMEI_PATH = STATE_DIR / "original_imei.txt"
 
 # ========= Config =========
 
+CONFIG_PATH = 'config.yaml'
+_YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+_cfg_lock = threading.Lock()
+_cfg_cache = {"mtime": None, "data": None, "rotation": None, "webhook": ""}
+API_TOKEN = ""
+
+@dataclass(frozen=True, slots=True)
+class RotationCfg:
+    """The `rotation:` section of config.yaml, parsed once per config change."""
+    teardown_wait: int
+    restart_wait: int
+    max_attempts: int
+    randomise_imei: bool
+    deep_enabled: bool
+    deep_method: str
+    deep_wait: int | None  # None -> per-link default
+
+def _parse_rotation_cfg(config):
+    rotation_config = (config or {}).get('rotation', {}) or {}
+    deep_enabled = bool(rotation_config.get('deep_reset_enabled', False))
+    deep_method  = (rotation_config.get('deep_reset_method', 'mmcli') or 'mmcli').lower()
+    if 'deep_reset' in rotation_config:  # backward compat
+        old = (rotation_config.get('deep_reset', '') or '').lower()
+        if old in ('mmcli', 'at'):
+            deep_enabled, deep_method = True, old
+        elif old in ('off', ''):
+            deep_enabled = False
+    deep_wait = rotation_config.get('deep_reset_wait')
+    return RotationCfg(
+        teardown_wait=int(rotation_config.get('ppp_teardown_wait', 30)),
+        restart_wait=int(rotation_config.get('ppp_restart_wait', 60)),
+        max_attempts=int(rotation_config.get('max_attempts', 2)),
+        randomise_imei=bool(rotation_config.get('randomise_imei', False)),
+        deep_enabled=deep_enabled,
+        deep_method=deep_method,
+        deep_wait=int(deep_wait) if deep_wait is not None else None,
+    )
+
+PLACEHOLDER_WEBHOOK_URL = "https://discord.com/api/webhooks/YOUR_WEBHOOK_ID/YOUR_TOKEN"
+
+def _parse_webhook_url(config):
+    """Usable Discord webhook URL from config, or "" if unset or still the placeholder."""
+    url = (((config or {}).get('discord') or {}).get('webhook_url') or '').strip()
+    return "" if url == PLACEHOLDER_WEBHOOK_URL else url
+
 def load_config():
-    with open('config.yaml', 'r') as f:
-        return yaml.safe_load(f)
+    """Parsed config.yaml, re-read only when the file's mtime changes. Treat as read-only."""
+    global API_TOKEN
+    mtime = os.stat(CONFIG_PATH).st_mtime_ns
+    with _cfg_lock:
+        if mtime != _cfg_cache["mtime"]:
+            with open(CONFIG_PATH, 'r') as f:
+                _cfg_cache["data"] = yaml.load(f, Loader=_YamlLoader)
+            _cfg_cache["mtime"] = mtime
+            # A bad value in one section must not break every caller of load_config()
+            try:
+                _cfg_cache["rotation"] = _parse_rotation_cfg(_cfg_cache["data"])
+            except Exception as e:
+                if _cfg_cache["rotation"] is None:
+                    _cfg_cache["rotation"] = _parse_rotation_cfg({})
+                print(f"⚠️ Invalid rotation settings in {CONFIG_PATH} ({e}); keeping previous values")
+            try:
+                _cfg_cache["webhook"] = _parse_webhook_url(_cfg_cache["data"])
+            except Exception as e:
+                print(f"⚠️ Invalid discord settings in {CONFIG_PATH} ({e}); keeping previous values")
+            try:
+                API_TOKEN = str(((_cfg_cache["data"] or {}).get('api') or {}).get('token') or "")
+            except Exception as e:
+                print(f"⚠️ Invalid api settings in {CONFIG_PATH} ({e}); keeping previous token")
+        return _cfg_cache["data"]
+
+def load_rotation_cfg():
+    """RotationCfg for the current config.yaml."""
+    load_config()
+    return _cfg_cache["rotation"]
+
+def discord_webhook_url():
+    """Validated Discord webhook URL for the current config.yaml ("" when not configured)."""
+    load_config()
+    return _cfg_cache["webhook"]
 
 # ========= File helpers =========
 
 def load_text(file_path: Path):
     try:
-        if file_path.exists():
-            return file_path.read_text(encoding="utf-8").strip() or None
-    except Exception:
-        pass
-    return None
+        return file_path.read_text(encoding="utf-8").strip() or None
+    except Exception:  # includes FileNotFoundError
+        return None
 
 def save_text(file_path: Path, content):
     try:
@@ -64,19 +188,75 @@ def save_text(file_path: Path, content):
 
 # ========= History =========
 
-def load_ip_history():
-    try:
-        if IP_HISTORY_PATH.exists():
-            return json.loads(IP_HISTORY_PATH.read_text(encoding="utf-8"))
-    except Exception:
-        pass
-    return {"ips": [], "rotations": 0, "first_seen": None}
-
-def save_ip_history(history):
+# ip_history.jsonl: a header line {"first_seen", "dropped"} followed by one
+# entry per line. Entries are only ever appended; the file is rewritten
+# (compacted) once it grows past HISTORY_COMPACT_AT lines.
+HISTORY_KEEP = 10
+HISTORY_COMPACT_AT = 500
+
+_hist_lock = threading.Lock()
+_hist = None  # loaded on first use: {"ips": deque, "first_seen", "dropped", "lines"}
+
+def _write_history_file(first_seen, dropped, entries):
+    lines = [json.dumps({"first_seen": first_seen, "dropped": dropped}, separators=(',', ':'))]
+    lines += [json.dumps(e, separators=(',', ':')) for e in entries]
+    tmp = IP_HISTORY_PATH.with_suffix(".tmp")
+    tmp.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    os.replace(tmp, IP_HISTORY_PATH)
+
+def _load_history_locked():
+    global _hist
+    if _hist is not None:
+        return _hist
+    ips = deque(maxlen=HISTORY_KEEP)
+    first_seen, dropped, lines = None, 0, 0
     try:
-        IP_HISTORY_PATH.write_text(json.dumps(history, indent=2), encoding="utf-8")
+        with open(IP_HISTORY_PATH, "rb+") as f:
+            data = f.read()
+            end = data.rfind(b"\n") + 1
+            if end < len(data):
+                # Torn last write (e.g. power loss): cut it off so the next
+                # O_APPEND entry starts on a line of its own
+                f.truncate(end)
+        for line in data[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue  # skip a corrupt line, keep the rest of the history
+            if not isinstance(rec, dict):
+                continue
+            if "ip" in rec:
+                ips.append(rec)
+                lines += 1
+            else:
+                first_seen, dropped = rec.get("first_seen"), int(rec.get("dropped", 0))
+    except FileNotFoundError:
+        # One-off migration from the old whole-file JSON history
+        try:
+            old = json.loads(LEGACY_IP_HISTORY_PATH.read_text(encoding="utf-8"))
+            entries = old.get("ips", [])
+            first_seen = old.get("first_seen")
+            dropped = max(0, int(old.get("rotations", 0)) + 1 - len(entries)) if entries else 0
+            ips.extend(entries)
+            lines = len(entries)
+            if entries:
+                _write_history_file(first_seen, dropped, entries)
+        except Exception:
+            pass
     except Exception as e:
-        print(f"Warning: Could not save IP history: {e}")
+        print(f"Warning: Could not read IP history: {e}")
+    _hist = {"ips": ips, "first_seen": first_seen, "dropped": dropped, "lines": lines}
+    return _hist
+
+def _history_view(h):
+    total = h["dropped"] + h["lines"]
+    return {"ips": list(h["ips"]), "rotations": max(0, total - 1), "first_seen": h["first_seen"]}
+
+def load_ip_history():
+    with _hist_lock:
+        return _history_view(_load_history_locked())
 
 def update_ip_history(current_ip, force_add=False, is_failure=False):
     """
@@ -87,16 +267,18 @@ def update_ip_history(current_ip, force_add=False, is_failure=False):
         force_add: If True, always add entry even if IP is the same (for failed rotations)
         is_failure: If True, mark this entry as a failed rotation
     """
-    history = load_ip_history()
-    now = datetime.now().isoformat()
+    with _hist_lock:
+        h = _load_history_locked()
+        # Add entry if IP changed OR if force_add is True (for failed rotation attempts)
+        if not (force_add or not h["ips"] or h["ips"][-1]["ip"] != current_ip):
+            return _history_view(h)
 
-    # Add entry if IP changed OR if force_add is True (for failed rotation attempts)
-    if force_add or not history["ips"] or history["ips"][-1]["ip"] != current_ip:
+        now = datetime.now()
         entry = {
             "ip": current_ip,
-            "timestamp": now,
-            "time": datetime.now().strftime("%H:%M:%S"),
-            "date": datetime.now().strftime("%d/%m/%Y")
+            "timestamp": now.isoformat(),
+            "time": now.strftime("%H:%M:%S"),
+            "date": now.strftime("%d/%m/%Y")
         }
 
         # Add failure flag if this is a failed rotation
@@ -104,55 +286,147 @@ def update_ip_history(current_ip, force_add=False, is_failure=False):
             entry["failed"] = True
             entry["note"] = "Rotation Failed - Same IP"
 
-        history["ips"].append(entry)
-
-        if history["first_seen"] is None:
-            history["first_seen"] = now
-        elif len(history["ips"]) > 1 or force_add:
-            history["rotations"] += 1
-        if len(history["ips"]) > 10:
-            history["ips"] = history["ips"][-10:]
-        save_ip_history(history)
-    return history
+        h["ips"].append(entry)
+        h["lines"] += 1
+        try:
+            if h["first_seen"] is None:
+                h["first_seen"] = entry["timestamp"]
+                _write_history_file(h["first_seen"], h["dropped"], h["ips"])
+            elif h["lines"] > HISTORY_COMPACT_AT:
+                h["dropped"] += h["lines"] - len(h["ips"])
+                h["lines"] = len(h["ips"])
+                _write_history_file(h["first_seen"], h["dropped"], h["ips"])
+            else:
+                # Single O_APPEND write: no rewrite of earlier entries
+                fd = os.open(IP_HISTORY_PATH, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                try:
+                    os.write(fd, (json.dumps(entry, separators=(',', ':')) + "\n").encode())
+                finally:
+                    os.close(fd)
+        except Exception as e:
+            print(f"Warning: Could not save IP history: {e}")
+        return _history_view(h)
 
 # ========= Network / modem =========
 
+_modem_port = None  # last detected AT port, reused until it disappears
+
 def detect_modem_port():
+    global _modem_port
+    if _modem_port and os.path.exists(_modem_port):
+        return _modem_port
+
     # SIM7600E typically uses ttyUSB2 and ttyUSB3 for AT commands
     # Check the most common AT command ports first
     for port in ['/dev/ttyUSB2', '/dev/ttyUSB3']:
         if os.path.exists(port):
+            _modem_port = port
             return port
     
-    # Fallback: scan for any ttyUSB port
-    for dev in os.listdir('/dev'):
-        if dev.startswith('ttyUSB'):
-            return f'/dev/{dev}'
+    # Fallback: the first ttyUSB port, if any
+    port = next(iter(sorted(glob.glob('/dev/ttyUSB*'))), None)
+    if port:
+        _modem_port = port
+        return port
     return '/dev/ttyUSB2'
 
+# Final result codes, matched against whole reply lines (so "ERROR" inside
+# some other line doesn't end the read early)
+AT_FINAL_RESULTS = (b"OK", b"ERROR", b"NO CARRIER")
+AT_FINAL_PREFIXES = (b"+CME ERROR:", b"+CMS ERROR:")
+AT_QUIET_GAP = 0.05  # seconds of silence after a reply line that ends the read
+
+# One long-lived handle to the AT port; hold _serial_lock while using it
+_serial_lock = threading.RLock()
+_serial_handle = None
+
+def _get_serial(port, baud=115200):
+    global _serial_handle
+    with _serial_lock:
+        if _serial_handle is None or not _serial_handle.is_open or _serial_handle.port != port:
+            if _serial_handle:
+                _serial_handle.close()
+            _serial_handle = serial.Serial(port, baud, timeout=1)
+        return _serial_handle
+
+def _drop_serial():
+    """Close the shared handle (e.g. after the modem re-enumerated)."""
+    global _serial_handle
+    with _serial_lock:
+        if _serial_handle:
+            try:
+                _serial_handle.close()
+            except Exception:
+                pass
+        _serial_handle = None
+
+atexit.register(_drop_serial)
+
 def at(cmd, port=None, baud=115200, read_delay=0.5, timeout=1):
+    """Send an AT command and return the reply.
+
+    Reads until a final result line arrives, the line goes quiet after a
+    reply line other than the echoed command, or max(read_delay, timeout)
+    seconds have passed. The echo alone never ends the read, so slow
+    +COPS/+CGPADDR answers aren't cut off.
+    """
     port = port or detect_modem_port()
     try:
-        with serial.Serial(port, baud, timeout=timeout) as ser:
+        with _serial_lock:
+            ser = _get_serial(port, baud)
+            ser.reset_input_buffer()
             ser.write((cmd + '\r').encode())
-            time.sleep(read_delay)
-            return ser.read_all().decode(errors='ignore')
+            echo = cmd.encode()
+            buf = bytearray()
+            answered = False  # seen a complete line that isn't the echo
+            deadline = time.time() + max(read_delay, timeout)
+            while time.time() < deadline:
+                ready, _, _ = select.select([ser.fd], [], [], AT_QUIET_GAP)
+                if ready:
+                    chunk = os.read(ser.fd, 4096)
+                    if not chunk:
+                        _drop_serial()  # readable but EOF: the tty hung up
+                        break
+                    buf += chunk
+                    lines = [l.strip() for l in bytes(buf).split(b"\n")[:-1]]
+                    lines = [l for l in lines if l and l != echo]
+                    if any(l in AT_FINAL_RESULTS or l.startswith(AT_FINAL_PREFIXES) for l in lines):
+                        break
+                    answered = bool(lines)
+                elif answered:
+                    break  # quiescent after a reply line
+            return buf.decode(errors='ignore')
     except Exception as e:
         print(f"AT error on {port}: {e}")
+        _drop_serial()
         return ""
 
+def at_step(cmd, port, settle):
+    """Send one AT command of a multi-step sequence and give the modem `settle` seconds.
+
+    The serial lock is only held while at() waits for the reply; the rest of
+    the settle time is slept unlocked so /status and other at() callers can
+    use the port between steps.
+    """
+    started = time.time()
+    reply = at(cmd, port=port, read_delay=settle, timeout=settle)
+    remaining = settle - (time.time() - started)
+    if remaining > 0:
+        time.sleep(remaining)
+    return reply
+
 def deep_reset_modem(method: str, wait_seconds: int):
     method = (method or "").lower().strip()
     print(f"Deep reset method: {method or 'none'} (wait {wait_seconds}s)")
     if method == "mmcli":
         try:
             print("MM: Starting ModemManager service...")
-            subprocess.run([SUDO_PATH, "-n", SYSTEMCTL_PATH, "start", "ModemManager"],
+            subprocess.run(MM_START_CMD,
                            check=False, capture_output=True, text=True, timeout=10)
             time.sleep(2)
 
             print("MM: Disabling modem...")
-            subprocess.run([SUDO_PATH, "-n", MMCLI_PATH, "-m", "0", "--disable"],
+            subprocess.run(MM_DISABLE_CMD,
                            check=False, capture_output=True, text=True, timeout=15)
             time.sleep(2)
 
@@ -160,12 +434,12 @@ def deep_reset_modem(method: str, wait_seconds: int):
             time.sleep(max(5, wait_seconds))
 
             print("MM: Enabling modem...")
-            subprocess.run([SUDO_PATH, "-n", MMCLI_PATH, "-m", "0", "--enable"],
+            subprocess.run(MM_ENABLE_CMD,
                            check=False, capture_output=True, text=True, timeout=15)
             time.sleep(3)
 
             print("MM: Stopping ModemManager service...")
-            subprocess.run([SUDO_PATH, "-n", SYSTEMCTL_PATH, "stop", "ModemManager"],
+            subprocess.run(MM_STOP_CMD,
                            check=False, capture_output=True, text=True, timeout=10)
             time.sleep(5)
             print("MM: Deep reset via ModemManager completed.")
@@ -181,6 +455,7 @@ def deep_reset_modem(method: str, wait_seconds: int):
             time.sleep(1.0)
             print("AT: Sending CFUN=1,1 (full function reset)…")
             at("AT+CFUN=1,1", port=p, read_delay=0.8, timeout=2)
+            _drop_serial()  # port goes away while the module reboots
             print(f"AT: Waiting {wait_seconds}s for module to re-enumerate…")
             time.sleep(max(30, wait_seconds))
             print("AT: Deep reset via AT completed.")
@@ -189,39 +464,169 @@ def deep_reset_modem(method: str, wait_seconds: int):
     else:
         print("Deep reset skipped.")
 
-def ensure_ppp_default_route():
+SIOCGIFADDR = 0x8915
+
+def iface_ipv4(iface):
+    """Return the IPv4 address assigned to iface, or None (ioctl, no fork)."""
     try:
-        res = subprocess.run([IP_PATH, "route", "show", "default"], capture_output=True, text=True, timeout=5)
-        line = res.stdout.splitlines()[0] if res.stdout else ""
-        parts = line.split()
-        gw = dev = None
-        metric = 100
-        for i, p in enumerate(parts):
-            if p == "via" and i+1 < len(parts):
-                gw = parts[i+1]
-            if p == "dev" and i+1 < len(parts):
-                dev = parts[i+1]
-            if p == "metric" and i+1 < len(parts):
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            packed = fcntl.ioctl(s.fileno(), SIOCGIFADDR, struct.pack('256s', iface[:15].encode()))
+        return socket.inet_ntoa(packed[20:24])
+    except OSError:
+        return None
+
+# ========= Kernel event waits =========
+
+NETLINK_KOBJECT_UEVENT = 15
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+
+def _wait_for_event(ready, timeout_s, proto=socket.NETLINK_ROUTE, groups=RTMGRP_LINK | RTMGRP_IPV4_IFADDR):
+    """
+    Block until ready() is true or timeout_s passes, re-checking whenever the
+    kernel multicasts a netlink event instead of on a fixed poll tick.
+    Falls back to a 1s poll if the netlink socket can't be opened.
+    """
+    deadline = time.monotonic() + timeout_s
+    try:
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, proto)
+        sock.bind((0, groups))
+    except OSError:
+        sock = None
+    try:
+        while True:
+            if ready():
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            if sock is None:
+                time.sleep(min(1.0, remaining))
+                continue
+            # Cap the wait so a missed event only costs a few seconds
+            if select.select([sock], [], [], min(remaining, 5.0))[0]:
                 try:
-                    metric = int(parts[i+1])
-                except Exception:
+                    while sock.recv(65536, socket.MSG_DONTWAIT):
+                        pass
+                except (BlockingIOError, OSError):
                     pass
+    finally:
+        if sock is not None:
+            sock.close()
+
+def _tty_usb_present():
+    """True as soon as any /dev/ttyUSB* entry is seen (stops at the first match)."""
+    try:
+        with os.scandir("/dev") as it:
+            return any(e.name.startswith("ttyUSB") for e in it)
+    except OSError:
+        return False
+
+def wait_for_tty_usb(timeout_s=15):
+    """Wait for the modem's ttyUSB ports to (re)appear after a reset (udev uevents)."""
+    return _wait_for_event(_tty_usb_present, timeout_s,
+                           proto=NETLINK_KOBJECT_UEVENT, groups=1)
+
+def ensure_ppp_default_route():
+    try:
+        res = subprocess.run(ROUTE_SHOW_DEFAULT_CMD, capture_output=True, text=True, timeout=5)
+        routes = json.loads(res.stdout or "[]")
+        primary = routes[0] if routes else {}
+        gw = primary.get("gateway")
+        dev = primary.get("dev")
+        metric = int(primary.get("metric", 100))
         if dev and dev != "ppp0":
-            subprocess.run([SUDO_PATH, "-n", IP_PATH, "route", "replace", "default",
-                            "via", gw, "dev", dev, "metric", str(metric)],
-                           check=False, capture_output=True, text=True, timeout=5)
-            subprocess.run([SUDO_PATH, "-n", IP_PATH, "route", "add", "default",
-                            "dev", "ppp0", "metric", str(metric + 500)],
-                           check=False, capture_output=True, text=True, timeout=5)
+            via = f"via {gw} " if gw else ""
+            with IpBatch(sudo=True) as b:
+                b.add(f"route replace default {via}dev {dev} metric {metric}")
+                b.add(f"route add default dev ppp0 metric {metric + 500}")
             print(f"Routing: kept {dev} primary (metric {metric}); added ppp0 (metric {metric+500})")
         else:
-            subprocess.run([SUDO_PATH, "-n", IP_PATH, "route", "add", "default",
-                            "dev", "ppp0", "metric", "600"],
+            subprocess.run(PPP_SECONDARY_ROUTE_CMD,
                            check=False, capture_output=True, text=True, timeout=5)
             print("Routing: added ppp0 as secondary (metric 600)")
     except Exception as e:
         print(f"Warning: Could not fix routing: {e}")
 
+class IpBatch:
+    """Stage `ip` commands and run them through a single `ip -force -batch -` process."""
+
+    def __init__(self, sudo=False):
+        self.argv = ([SUDO_PATH, "-n"] if sudo else []) + [IP_PATH, "-force", "-batch", "-"]
+        self.returncode = None
+
+    def __enter__(self):
+        self.proc = subprocess.Popen(self.argv, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                     stderr=subprocess.PIPE, text=True, env=_MINIMAL_ENV)
+        return self
+
+    def add(self, cmd):
+        try:
+            self.proc.stdin.write(cmd + "\n")
+        except BrokenPipeError:
+            pass  # process already exited; returncode reports the failure
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.stderr = self.proc.communicate(timeout=5)[1]
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+            self.stderr = self.proc.communicate()[1]
+        self.returncode = self.proc.returncode
+        return False
+
+class IptablesRestore(IpBatch):
+    """Stage rules for one table and commit them atomically via `iptables-restore --noflush`."""
+
+    def __init__(self, table="filter", sudo=False):
+        super().__init__(sudo)
+        self.argv = ([SUDO_PATH, "-n"] if sudo else []) + [IPTABLES_RESTORE_PATH, "--noflush"]
+        self.table = table
+
+    def __enter__(self):
+        super().__enter__()
+        self.add(f"*{self.table}")
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            # Body raised part-way through: discard the staged rules, never commit them
+            self.proc.kill()
+            self.stderr = self.proc.communicate()[1]
+            self.returncode = self.proc.returncode
+            return False
+        self.add("COMMIT")
+        return super().__exit__(exc_type, exc, tb)
+
+# Squid (uid "proxy") traffic is marked in mangle/OUTPUT and routed via table "ppp"
+PPP_POLICY_IP_CMDS = (
+    "route replace default dev ppp0 table ppp",
+    "rule del fwmark 0x1 lookup ppp",
+    "rule add fwmark 0x1 lookup ppp priority 1000",
+)
+PPP_MARK_RULE = "OUTPUT -m owner --uid-owner proxy -j MARK --set-mark 1"
+PPP_MANGLE_CMDS = (f"-D {PPP_MARK_RULE}", f"-A {PPP_MARK_RULE}")
+
+def _apply_ppp_policy_routing():
+    """Re-apply the ppp routing table, fwmark rule and Squid packet mark."""
+    print("Re-applying policy routing for Squid...")
+    try:
+        with IpBatch() as b:
+            for cmd in PPP_POLICY_IP_CMDS:
+                b.add(cmd)
+
+        # -D and -A are committed together so the mark never disappears;
+        # if the rule wasn't there yet the -D fails the whole batch, so add only
+        with IptablesRestore("mangle") as r:
+            for cmd in PPP_MANGLE_CMDS:
+                r.add(cmd)
+        if r.returncode != 0:
+            with IptablesRestore("mangle") as r:
+                r.add(PPP_MANGLE_CMDS[1])
+        print("✅ Policy routing re-applied")
+    except Exception as e:
+        print(f"⚠️ Policy routing re-application failed: {e}")
+
 def get_network_type():
     """Detect current network type (3G/4G only) from modem."""
     try:
@@ -229,23 +634,19 @@ def get_network_type():
         if not at_port or not os.path.exists(at_port):
             return "4G"  # Default to 4G
         
-        # Try to open port with very short timeout to avoid blocking
-        with serial.Serial(at_port, 115200, timeout=1) as ser:
-            # Quick AT command with minimal wait
-            ser.write(b"AT+COPS?\r\n")
-            time.sleep(0.5)  # Much shorter wait
-            cops_response = ser.read_all().decode(errors='ignore')
-            
-            # Parse network type from response
-            combined = cops_response.upper()
-            
-            if "LTE" in combined or "4G" in combined:
-                return "4G"
-            elif "UMTS" in combined or "3G" in combined:
-                return "3G"
-            else:
-                # Default to 4G if we can't detect (most likely on modern networks)
-                return "4G"
+        # Quick AT command with minimal wait, over the shared AT handle
+        cops_response = at_step("AT+COPS?", at_port, 0.5)  # Much shorter wait
+
+        # Parse network type from response
+        combined = cops_response.upper()
+
+        if "LTE" in combined or "4G" in combined:
+            return "4G"
+        elif "UMTS" in combined or "3G" in combined:
+            return "3G"
+        else:
+            # Default to 4G if we can't detect (most likely on modern networks)
+            return "4G"
     except Exception:
         # Default to 4G if detection fails (port busy or other error)
         return "4G"
@@ -257,106 +658,133 @@ def get_current_apn():
         if not at_port or not os.path.exists(at_port):
             return "Unknown"
         
-        # Try to open port with longer timeout for APN detection
-        with serial.Serial(at_port, 115200, timeout=3) as ser:
-            # Try multiple AT commands to get APN info
-            ser.write(b"AT+CGDCONT?\r\n")
-            time.sleep(2)  # Longer wait for response
-            apn_response = ser.read_all().decode(errors='ignore')
-            
-            # If empty, try alternative commands
-            if not apn_response or len(apn_response.strip()) < 10:
-                print("🔍 Trying alternative APN commands...")
-                
-                # Try different AT commands
-                commands = [
-                    b"AT+CGDCONT=1\r\n",  # Set PDP context
-                    b"AT+CGDCONT?\r\n",    # Query again
-                    b"AT+COPS?\r\n",       # Check operator
-                    b"AT+CGPADDR=1\r\n"    # Get IP address
-                ]
-                
-                for cmd in commands:
-                    ser.write(cmd)
-                    time.sleep(1)
-                    response = ser.read_all().decode(errors='ignore')
-                    if response and len(response.strip()) > 5:
-                        apn_response += response
-                        print(f"🔍 Got response from {cmd}: {response[:50]}...")
-                
-                # Final attempt
-                ser.write(b"AT+CGDCONT?\r\n")
-                time.sleep(2)
-                final_response = ser.read_all().decode(errors='ignore')
-                if final_response:
-                    apn_response = final_response
-            
-            print(f"🔍 APN Response: {repr(apn_response)}")  # Debug output
-            
-            # Parse APN from response (multiple patterns)
-            import re
-            
-            # Check if Three UK (operator "3")
-            if '+COPS: 0,0,"3"' in apn_response or '"3"' in apn_response:
-                return "Auto (Three UK)"
-            
-            # Try different patterns
-            patterns = [
-                r'\+CGDCONT:\s*\d+,\s*"IP",\s*"([^"]+)"',  # Standard format
-                r'\+CGDCONT:.*?"([^"]+)"',                 # Any quoted string
-                r'CGDCONT.*?(\w+\.\w+\.\w+)',              # Domain format
-                r'CGDCONT.*?(three|internet|everywhere)',  # Known APNs
+        # Try multiple AT commands to get APN info
+        apn_response = at_step("AT+CGDCONT?", at_port, 2)  # Longer wait for response
+
+        # If empty, try alternative commands
+        if not apn_response or len(apn_response.strip()) < 10:
+            print("🔍 Trying alternative APN commands...")
+
+            # Try different AT commands
+            commands = [
+                "AT+CGDCONT=1",  # Set PDP context
+                "AT+CGDCONT?",    # Query again
+                "AT+COPS?",       # Check operator
+                "AT+CGPADDR=1"    # Get IP address
             ]
-            
-            for pattern in patterns:
-                apn_match = re.search(pattern, apn_response, re.IGNORECASE)
-                if apn_match:
-                    apn = apn_match.group(1)
-                    if apn and len(apn) > 2:  # Valid APN length
-                        return apn
-            
-            # If all APNs are empty, check for auto-detection
-            if '"","0.0.0.0"' in apn_response or '""' in apn_response:
-                return "Auto-detected"
-            
-            # If no pattern matches, try to extract any word after CGDCONT
-            words = apn_response.split()
-            for i, word in enumerate(words):
-                if 'CGDCONT' in word and i + 2 < len(words):
-                    potential_apn = words[i + 2].strip('"')
-                    if '.' in potential_apn or potential_apn.lower() in ['internet', 'everywhere', 'three']:
-                        return potential_apn
-            
-            return "Unknown"
+
+            for cmd in commands:
+                response = at_step(cmd, at_port, 1)
+                if response and len(response.strip()) > 5:
+                    apn_response += response
+                    print(f"🔍 Got response from {cmd}: {response[:50]}...")
+
+            # Final attempt
+            final_response = at_step("AT+CGDCONT?", at_port, 2)
+            if final_response:
+                apn_response = final_response
+
+        print(f"🔍 APN Response: {repr(apn_response)}")  # Debug output
+
+        # Parse APN from response (multiple patterns)
+        import re
+
+        # Check if Three UK (operator "3")
+        if '+COPS: 0,0,"3"' in apn_response or '"3"' in apn_response:
+            return "Auto (Three UK)"
+
+        # Try different patterns
+        patterns = [
+            r'\+CGDCONT:\s*\d+,\s*"IP",\s*"([^"]+)"',  # Standard format
+            r'\+CGDCONT:.*?"([^"]+)"',                 # Any quoted string
+            r'CGDCONT.*?(\w+\.\w+\.\w+)',              # Domain format
+            r'CGDCONT.*?(three|internet|everywhere)',  # Known APNs
+        ]
+
+        for pattern in patterns:
+            apn_match = re.search(pattern, apn_response, re.IGNORECASE)
+            if apn_match:
+                apn = apn_match.group(1)
+                if apn and len(apn) > 2:  # Valid APN length
+                    return apn
+
+        # If all APNs are empty, check for auto-detection
+        if '"","0.0.0.0"' in apn_response or '""' in apn_response:
+            return "Auto-detected"
+
+        # If no pattern matches, try to extract any word after CGDCONT
+        words = apn_response.split()
+        for i, word in enumerate(words):
+            if 'CGDCONT' in word and i + 2 < len(words):
+                potential_apn = words[i + 2].strip('"')
+                if '.' in potential_apn or potential_apn.lower() in ['internet', 'everywhere', 'three']:
+                    return potential_apn
+
+        return "Unknown"
     except Exception as e:
         print(f"🔍 APN detection error: {e}")
         return "Unknown"
 
+def get_local_cellular_ip():
+    """
+    Return (mode, iface, ip) for the active cellular link, or
+    (None, None, None). Only reads local interface state, so it is cheap
+    enough for every status poll.
+    """
+    # Check QMI first, then RNDIS, then PPP
+    qmi_iface, qmi_has_ip = detect_qmi_interface()
+    if qmi_iface and qmi_has_ip:
+        return "QMI", qmi_iface, iface_ipv4(qmi_iface)
+
+    rndis_iface, rndis_has_ip = detect_rndis_interface()
+    if rndis_iface and rndis_has_ip:
+        return "RNDIS", rndis_iface, iface_ipv4(rndis_iface)
+
+    ppp_ip = iface_ipv4("ppp0")
+    if ppp_ip:
+        return "PPP", "ppp0", ppp_ip
+    return None, None, None
+
+# Last public IP lookup result; kept warm by public_ip_refresher()
+_ip_cache = {"ip": "Unknown", "ts": 0.0}
+PUBLIC_IP_REFRESH_SECONDS = 60
+PUBLIC_IP_TTL_SECONDS = 2.0
+
+def lookup_public_ip(ttl=PUBLIC_IP_TTL_SECONDS):
+    """Public IP via the proxy, reusing a lookup made within the last ttl seconds."""
+    now = time.monotonic()
+    if _ip_cache["ts"] and now - _ip_cache["ts"] < ttl:
+        return _ip_cache["ip"]
+    ip = _query_public_ip()
+    _ip_cache.update(ip=ip, ts=time.monotonic())
+    return ip
+
+def invalidate_public_ip():
+    """Force the next lookup_public_ip() to go out to the network (after a link restart)."""
+    _ip_cache["ts"] = 0.0
+
 def get_current_ip():
     """Get current public IPv4 address via cellular interface only."""
-    global in_progress
-
     # If rotation is in progress, return "Rotating..." to avoid showing WiFi IP
-    if in_progress:
+    if rotation_in_progress():
         return "Rotating..."
 
-    # Check for QMI interface first
-    qmi_iface, qmi_has_ip = detect_qmi_interface()
+    return lookup_public_ip()
 
-    # If QMI is down, check for RNDIS
-    if not (qmi_iface and qmi_has_ip):
-        rndis_iface, rndis_has_ip = detect_rndis_interface()
+def public_ip_refresher():
+    """Background loop that refreshes the cached public IP for /status."""
+    while True:
+        try:
+            get_current_ip()
+        except Exception as e:
+            print(f"Public IP refresh failed: {e}")
+        time.sleep(PUBLIC_IP_REFRESH_SECONDS)
 
-        # If RNDIS is also down, check for PPP
-        if not (rndis_iface and rndis_has_ip):
-            try:
-                r = subprocess.run([IP_PATH, "-4", "addr", "show", "ppp0"],
-                                   capture_output=True, text=True, timeout=3)
-                if r.returncode != 0 or "inet " not in r.stdout:
-                    # No cellular interface is up
-                    return "No cellular connection"
-            except Exception:
-                return "No cellular connection"
+def _query_public_ip():
+    mode, _, _ = get_local_cellular_ip()
+    if not mode:
+        # No cellular interface is up
+        return "No cellular connection"
 
     # Cellular interface is up, check public IP via proxy
     try:
@@ -368,24 +796,22 @@ def get_current_ip():
             'http': f'http://{lan_ip}:3128',
             'https': f'http://{lan_ip}:3128'
         }
-        r = requests.get('https://api.ipify.org', proxies=proxies, timeout=8)
+        r = http_session.get('https://api.ipify.org', proxies=proxies, timeout=8)
         ip = r.text.strip()
 
         # Check if this looks like a valid public IP
-        if not ip or len(ip) < 7:
+        try:
+            addr = ipaddress.ip_address(ip)
+        except ValueError:
             return "Unknown - proxy failed"
-        
+
         # If we get a private IP, it means proxy is routing through WiFi/LAN
         # This indicates the cellular routing is broken
-        if (
-            ip.startswith('192.168.')
-            or ip.startswith('10.')
-            or ip.startswith('172.')
-        ):
-            # Check if it's the user's home IP (EE hub)
-            if ip.startswith('86.151.'):
-                return f"⚠️ WiFi IP: {ip} (cellular routing broken!)"
+        if addr.is_private:
             return f"⚠️ LAN IP: {ip} (cellular routing broken!)"
+        # Check if it's the user's home IP (EE hub)
+        if ip.startswith('86.151.'):
+            return f"⚠️ WiFi IP: {ip} (cellular routing broken!)"
 
         # Valid cellular IP
         return ip
@@ -399,19 +825,25 @@ def get_current_ip():
 
 # ========= Discord =========
 
-def build_discord_embed(current_ip, previous_ip=None, is_rotation=False, is_failure=False, error_message=None):
+DISCORD_FOOTER = "4G Mobile Proxy Server • {}"
+
+# Webhook calls are made off the request threads by _notify_worker()
+_notify_q = queue.Queue(maxsize=256)
+
+def build_discord_embed(current_ip, previous_ip=None, is_rotation=False, is_failure=False, error_message=None, is_initial=False):
     history = load_ip_history()
+    now = datetime.now()
 
     history_text = ""
     if history["ips"]:
-        history_text = "\n\n**📋 Recent IP History:**\n"
-        for ip_entry in history["ips"][-5:]:
-            history_text += f"• `{ip_entry['ip']}` - {ip_entry['time']} {ip_entry['date']}\n"
+        history_text = "\n\n**📋 Recent IP History:**\n" + "".join(
+            f"• `{e['ip']}` - {e['time']} {e['date']}\n" for e in history["ips"][-5:]
+        )
 
     uptime_text = ""
     if history["first_seen"]:
         first_seen = datetime.fromisoformat(history["first_seen"])
-        uptime = datetime.now() - first_seen
+        uptime = now - first_seen
         hours = int(uptime.total_seconds() // 3600)
         minutes = int((uptime.total_seconds() % 3600) // 60)
         uptime_text = f"\n**⏱️ Uptime:** {hours}h {minutes}m | **🔄 Total Rotations:** {history['rotations']}"
@@ -441,8 +873,8 @@ def build_discord_embed(current_ip, previous_ip=None, is_rotation=False, is_fail
         "title": title,
         "description": description,
         "color": color,
-        "footer": {"text": f"4G Mobile Proxy Server • {datetime.now().strftime('%d/%m/%Y %H:%M')}"},
-        "timestamp": datetime.now().isoformat()
+        "footer": {"text": DISCORD_FOOTER.format(now.strftime('%d/%m/%Y %H:%M'))},
+        "timestamp": now.isoformat()
     }
     return {
         "content": None,
@@ -455,7 +887,7 @@ def post_or_patch_discord(webhook_url, payload, msg_id_file):
     if message_id:
         url = f"{webhook_url.split('?')[0]}/messages/{message_id}"
         try:
-            r = requests.patch(url, json=payload, timeout=20)
+            r = http_session.patch(url, json=payload, timeout=20)
             r.raise_for_status()
             return ("patched", message_id)
         except requests.exceptions.HTTPError as e:
@@ -466,7 +898,7 @@ def post_or_patch_discord(webhook_url, payload, msg_id_file):
                 raise
     if not message_id:
         url = f"{webhook_url}?wait=true" if "?wait" not in webhook_url else webhook_url
-        r = requests.post(url, json=payload, timeout=20)
+        r = http_session.post(url, json=payload, timeout=20)
         r.raise_for_status()
         data = r.json()
         new_id = str(data.get("id", "")).strip()
@@ -537,54 +969,48 @@ def record_initial_ip():
         return False
 
 def send_discord_notification(current_ip, previous_ip=None, is_rotation=False, is_failure=False, error_message=None, is_initial=False):
-    config = load_config()
-    webhook_url = config.get('discord', {}).get('webhook_url', '').strip()
-    if not webhook_url or webhook_url == "https://discord.com/api/webhooks/YOUR_WEBHOOK_ID/YOUR_TOKEN":
+    """
+    Queue a Discord notification for the notify worker; returns False if not
+    configured or the queue is full. current_ip=None is resolved by the worker.
+    """
+    webhook_url = discord_webhook_url()
+    if not webhook_url:
         return False
 
     # Note: History update is now handled in rotation code before calling this function
     # This ensures the embed includes the latest entry (including failures)
-
     try:
-        payload = build_discord_embed(current_ip, previous_ip, is_rotation, is_failure, error_message)
-        action, msg_id = post_or_patch_discord(webhook_url, payload, MSG_ID_PATH)
-        print(f"Discord notification {action} (ID: {msg_id})")
+        _notify_q.put_nowait((webhook_url, current_ip, previous_ip, is_rotation, is_failure, error_message, is_initial))
         return True
-    except Exception as e:
-        print(f"Failed to send Discord notification: {e}")
+    except queue.Full:
+        print("Discord notification queue full, dropping notification")
         return False
 
+def _notify_worker():
+    """Deliver queued Discord notifications one at a time."""
+    while True:
+        webhook_url, current_ip, previous_ip, is_rotation, is_failure, error_message, is_initial = _notify_q.get()
+        try:
+            if current_ip is None:
+                current_ip = get_current_ip()
+            payload = build_discord_embed(current_ip, previous_ip, is_rotation, is_failure, error_message, is_initial)
+            action, msg_id = post_or_patch_discord(webhook_url, payload, MSG_ID_PATH)
+            print(f"Discord notification {action} (ID: {msg_id})")
+        except Exception as e:
+            print(f"Failed to send Discord notification: {e}")
+        finally:
+            _notify_q.task_done()
+
+threading.Thread(target=_notify_worker, name="discord-notify", daemon=True).start()
+
 # ========= QMI helpers =========
 
 def detect_qmi_interface():
     """Detect QMI interface (wwan*) that provides cellular connectivity."""
     try:
-        ip_cmd = IP_PATH if IP_PATH and os.path.exists(IP_PATH) else "/usr/sbin/ip"
-
-        result = subprocess.run([ip_cmd, "-br", "link", "show"],
-                                capture_output=True, text=True, check=False, timeout=5)
-        if result.returncode != 0:
-            return None, False
-
-        for line in result.stdout.splitlines():
-            line = line.strip()
-            if line.startswith("wwan"):
-                parts = line.split()
-                if not parts:
-                    continue
-                iface = parts[0]
-
-                # Check if interface has an IP address
-                ip_result = subprocess.run([ip_cmd, "-4", "addr", "show", iface],
-                                           capture_output=True, text=True, check=False, timeout=5)
-                if ip_result.returncode != 0:
-                    return iface, False
-
-                if "inet " in ip_result.stdout:
-                    return iface, True
-                else:
-                    return iface, False
-
+        for _, iface in socket.if_nameindex():
+            if iface.startswith("wwan"):
+                return iface, iface_ipv4(iface) is not None
     except Exception as e:
         # Only log exceptions during rotation or startup, not on every status check
         pass
@@ -593,10 +1019,8 @@ def detect_qmi_interface():
 def get_original_imei():
     """Get the original (factory) IMEI from state file."""
     try:
-        if ORIGINAL_IMEI_PATH.exists():
-            return ORIGINAL_IMEI_PATH.read_text(encoding="utf-8").strip()
-        return None
-    except Exception:
+        return ORIGINAL_IMEI_PATH.read_text(encoding="utf-8").strip()
+    except Exception:  # includes FileNotFoundError: nothing saved yet
         return None
 
 def save_original_imei(imei):
@@ -681,30 +1105,26 @@ def randomise_imei():
             print("⚠️ No modem control device found for IMEI change")
             return False
         
-        with serial.Serial(modem_dev, 115200, timeout=5) as ser:
-            # Try AT+EGMR command (works on some modems)
-            ser.write(f'AT+EGMR=1,7,"{random_imei}"\r\n'.encode())
-            time.sleep(2)
-            response = ser.read_all().decode(errors='ignore')
-            print(f"  📡 IMEI set response: {response.strip()}")
-            
-            # Check if command was successful
-            if "ERROR" in response.upper():
-                print(f"  ⚠️ AT+EGMR command not supported by this modem")
-                print(f"  ℹ️  SIM7600E-H may not support IMEI changes via AT commands")
-                print(f"  ℹ️  IMEI randomisation is disabled for this modem model")
-                return False
-            
-            if "OK" not in response.upper():
-                print(f"  ⚠️ IMEI change command returned unexpected response")
-                return False
-            
-            # Reset modem to apply IMEI change
-            print("  📡 Rebooting modem to apply new IMEI...")
-            ser.write(b"AT+CFUN=1,1\r\n")
-            time.sleep(2)
-            ser.read_all()
-        
+        # Try AT+EGMR command (works on some modems)
+        response = at_step(f'AT+EGMR=1,7,"{random_imei}"', modem_dev, 2)
+        print(f"  📡 IMEI set response: {response.strip()}")
+
+        # Check if command was successful
+        if "ERROR" in response.upper():
+            print(f"  ⚠️ AT+EGMR command not supported by this modem")
+            print(f"  ℹ️  SIM7600E-H may not support IMEI changes via AT commands")
+            print(f"  ℹ️  IMEI randomisation is disabled for this modem model")
+            return False
+
+        if "OK" not in response.upper():
+            print(f"  ⚠️ IMEI change command returned unexpected response")
+            return False
+
+        # Reset modem to apply IMEI change
+        print("  📡 Rebooting modem to apply new IMEI...")
+        at_step("AT+CFUN=1,1", modem_dev, 2)
+        _drop_serial()  # the tty goes away while the module re-enumerates
+
         print("  ⏱️ Waiting 30 seconds for modem to reboot...")
         time.sleep(30)
         print("  ✅ IMEI randomisation complete")
@@ -740,42 +1160,29 @@ def deep_reset_qmi_modem(randomise_imei_enabled=False):
             print("⚠️ No modem control device found")
             return False
 
-        with serial.Serial(modem_dev, 115200, timeout=5) as ser:
-            # 1. Deactivate PDP context
-            print("📡 Deactivating PDP context...")
-            ser.write(b"AT+CGACT=0,1\r\n")
-            time.sleep(2)
-            ser.read(1000)
+        # 1. Deactivate PDP context
+        print("📡 Deactivating PDP context...")
+        at_step("AT+CGACT=0,1", modem_dev, 2)
 
-            # 2. Detach from network
-            print("📡 Detaching from network...")
-            ser.write(b"AT+CGATT=0\r\n")
-            time.sleep(2)
-            ser.read(1000)
+        # 2. Detach from network
+        print("📡 Detaching from network...")
+        at_step("AT+CGATT=0", modem_dev, 2)
 
-            # 3. Radio off
-            print("📴 Radio off...")
-            ser.write(b"AT+CFUN=0\r\n")
-            time.sleep(5)
-            ser.read(1000)
+        # 3. Radio off
+        print("📴 Radio off...")
+        at_step("AT+CFUN=0", modem_dev, 5)
 
-            # 4. Radio on
-            print("📡 Radio on...")
-            ser.write(b"AT+CFUN=1\r\n")
-            time.sleep(5)
-            ser.read(1000)
+        # 4. Radio on
+        print("📡 Radio on...")
+        at_step("AT+CFUN=1", modem_dev, 5)
 
-            # 5. Reattach to network
-            print("📡 Reattaching to network...")
-            ser.write(b"AT+CGATT=1\r\n")
-            time.sleep(2)
-            ser.read(1000)
+        # 5. Reattach to network
+        print("📡 Reattaching to network...")
+        at_step("AT+CGATT=1", modem_dev, 2)
 
-            # 6. Reactivate PDP context
-            print("📡 Reactivating PDP context...")
-            ser.write(b"AT+CGACT=1,1\r\n")
-            time.sleep(2)
-            ser.read(1000)
+        # 6. Reactivate PDP context
+        print("📡 Reactivating PDP context...")
+        at_step("AT+CGACT=1,1", modem_dev, 2)
 
         print("✅ Deep QMI modem reset complete")
         return True
@@ -801,8 +1208,7 @@ def teardown_qmi(wait_s: int, deep_reset: bool = False, randomise_imei_enabled:
         time.sleep(2)
 
         # Bring interface down
-        subprocess.run([SUDO_PATH, "-n", IP_PATH, "link", "set", "dev", iface, "down"],
-                       capture_output=True, text=True, check=False)
+        link_set(iface, "down")
 
         # Perform deep reset if requested
         if deep_reset:
@@ -823,8 +1229,7 @@ def start_qmi():
     print(f"Starting QMI connection for: {iface}")
 
     # Bring interface up
-    res = subprocess.run([SUDO_PATH, "-n", IP_PATH, "link", "set", "dev", iface, "up"],
-                         capture_output=True, text=True, check=False)
+    res = link_set(iface, "up")
     if res.returncode != 0:
         raise RuntimeError(f"Failed to bring up {iface}: {res.stderr.strip()}")
 
@@ -860,46 +1265,16 @@ def start_qmi():
 
 def wait_for_qmi_up(timeout_s: int) -> bool:
     """Wait for QMI interface to get an IP address."""
-    deadline = time.time() + max(5, int(timeout_s))
-    while time.time() < deadline:
-        iface, has_ip = detect_qmi_interface()
-        if iface and has_ip:
-            return True
-        time.sleep(2)
-    return False
+    return _wait_for_event(lambda: all(detect_qmi_interface()), max(5, int(timeout_s)))
 
 # ========= RNDIS helpers =========
 
 def detect_rndis_interface():
     """Detect RNDIS interface (enx*) that provides cellular connectivity."""
     try:
-        # Use absolute path to avoid subprocess issues
-        ip_cmd = IP_PATH if IP_PATH and os.path.exists(IP_PATH) else "/usr/sbin/ip"
-
-        result = subprocess.run([ip_cmd, "-br", "link", "show"],
-                                capture_output=True, text=True, check=False, timeout=5)
-        if result.returncode != 0:
-            return None, False
-
-        for line in result.stdout.splitlines():
-            line = line.strip()
-            if line.startswith("enx") or line.startswith("eth1"):
-                parts = line.split()
-                if not parts:
-                    continue
-                iface = parts[0]
-
-                # Check if interface has an IP address
-                ip_result = subprocess.run([ip_cmd, "-4", "addr", "show", iface],
-                                           capture_output=True, text=True, check=False, timeout=5)
-                if ip_result.returncode != 0:
-                    return iface, False
-
-                if "inet " in ip_result.stdout:
-                    return iface, True
-                else:
-                    return iface, False
-
+        for _, iface in socket.if_nameindex():
+            if iface.startswith("enx") or iface.startswith("eth1"):
+                return iface, iface_ipv4(iface) is not None
     except Exception as e:
         # Only log exceptions during rotation or startup, not on every status check
         pass
@@ -913,22 +1288,19 @@ def get_carrier_apns():
         if not at_port or not os.path.exists(at_port):
             return ["internet"]  # Default fallback
         
-        with serial.Serial(at_port, 115200, timeout=2) as ser:
-            ser.write(b"AT+COPS?\r\n")
-            time.sleep(1)
-            cops_response = ser.read_all().decode(errors='ignore')
-            
-            # Detect carrier from COPS response
-            if "23410" in cops_response or "three" in cops_response.lower():
-                return ["three.co.uk", "internet", "3internet"]
-            elif "23415" in cops_response or "vodafone" in cops_response.lower():
-                return ["internet", "web", "vpn"]
-            elif "23430" in cops_response or "ee" in cops_response.lower():
-                return ["everywhere", "internet"]
-            elif "23402" in cops_response or "o2" in cops_response.lower():
-                return ["internet", "wap", "contract"]
-            else:
-                return ["internet"]  # Default fallback
+        cops_response = at_step("AT+COPS?", at_port, 1)
+
+        # Detect carrier from COPS response
+        if "23410" in cops_response or "three" in cops_response.lower():
+            return ["three.co.uk", "internet", "3internet"]
+        elif "23415" in cops_response or "vodafone" in cops_response.lower():
+            return ["internet", "web", "vpn"]
+        elif "23430" in cops_response or "ee" in cops_response.lower():
+            return ["everywhere", "internet"]
+        elif "23402" in cops_response or "o2" in cops_response.lower():
+            return ["internet", "wap", "contract"]
+        else:
+            return ["internet"]  # Default fallback
     except Exception:
         return ["internet"]  # Default fallback
 
@@ -945,31 +1317,22 @@ def smart_apn_rotation():
         apns = get_carrier_apns()
         print(f"  📡 Available APNs for carrier: {apns}")
         
-        with serial.Serial(at_port, 115200, timeout=5) as ser:
-            # Get current APN
-            ser.write(b"AT+CGDCONT?\r\n")
-            time.sleep(2)
-            current_apn_response = ser.read_all().decode(errors='ignore')
-            print(f"  📡 Current APN response: {current_apn_response}")
-            
-            # Try switching to a different APN
-            for apn in apns:
-                print(f"  📡 Trying APN: {apn}")
-                ser.write(f"AT+CGDCONT=1,\"IP\",\"{apn}\"\r\n".encode())
-                time.sleep(2)
-                ser.read_all()
-                
-                # Deactivate and reactivate
-                ser.write(b"AT+CGACT=0,1\r\n")
-                time.sleep(2)
-                ser.read_all()
-                
-                ser.write(b"AT+CGACT=1,1\r\n")
-                time.sleep(3)
-                ser.read_all()
-                
-                print(f"  ✅ Switched to APN: {apn}")
-                return True
+        # Get current APN
+        current_apn_response = at_step("AT+CGDCONT?", at_port, 2)
+        print(f"  📡 Current APN response: {current_apn_response}")
+
+        # Try switching to a different APN
+        for apn in apns:
+            print(f"  📡 Trying APN: {apn}")
+            at_step(f"AT+CGDCONT=1,\"IP\",\"{apn}\"", at_port, 2)
+
+            # Deactivate and reactivate
+            at_step("AT+CGACT=0,1", at_port, 2)
+
+            at_step("AT+CGACT=1,1", at_port, 3)
+
+            print(f"  ✅ Switched to APN: {apn}")
+            return True
 
         return False
     except Exception as e:
@@ -994,68 +1357,47 @@ def smart_ip_rotation_rndis_modem(randomise_imei_enabled=False, wait_seconds=30)
             print(f"⚠️ Smart rotation skipped: AT port {at_port} not available")
             return False
 
-        with serial.Serial(at_port, 115200, timeout=5) as ser:
-            # Step 1: Deactivate PDP context (disconnect data session)
-            print("  📡 Deactivating PDP context...")
-            ser.write(b"AT+CGACT=0,1\r\n")
-            time.sleep(2)
-            ser.read_all()
-            
-            # Step 2: Detach from packet network (forces carrier to release IP)
-            print("  📡 Detaching from packet network...")
-            ser.write(b"AT+CGATT=0\r\n")
-            time.sleep(3)
-            ser.read_all()
+        # Step 1: Deactivate PDP context (disconnect data session)
+        print("  📡 Deactivating PDP context...")
+        at_step("AT+CGACT=0,1", at_port, 2)
 
-            # Step 3: Network deregistration (forces clean disconnect)
-            print("  📡 Deregistering from network...")
-            ser.write(b"AT+COPS=2\r\n")
-            time.sleep(3)
-            ser.read_all()
-            
-            # Step 4: Wait for carrier to forget us (critical for sticky CGNAT)
-            print(f"  ⏱️ Waiting {wait_seconds}s for carrier to release IP assignment...")
-            time.sleep(max(20, wait_seconds))
-
-            # Step 5: Switch network mode (4G -> 3G -> 4G for new IP pool)
-            print("  📡 Switching to 3G mode...")
-            ser.write(b"AT+CNMP=14\r\n")  # 3G only
-            time.sleep(4)
-            ser.read_all()
-            
-            # Step 6: Switch back to 4G mode (forces re-registration)
-            print("  📡 Switching back to 4G mode...")
-            ser.write(b"AT+CNMP=38\r\n")  # 4G only (LTE preferred)
-            time.sleep(4)
-            ser.read_all()
-
-            # Step 7: Try APN cycling (sometimes triggers new IP pool)
-            print("  📡 Cycling APN for fresh IP pool...")
-            ser.write(b'AT+CGDCONT=1,"IP","eesecure"\r\n')  # Switch to eesecure
-            time.sleep(2)
-            ser.read_all()
-            
-            ser.write(b'AT+CGDCONT=1,"IP","everywhere"\r\n')  # Back to everywhere
-            time.sleep(2)
-            ser.read_all()
-            
-            # Step 8: Auto-register to network
-            print("  📡 Auto-registering to network...")
-            ser.write(b"AT+COPS=0\r\n")
-            time.sleep(5)
-            ser.read_all()
+        # Step 2: Detach from packet network (forces carrier to release IP)
+        print("  📡 Detaching from packet network...")
+        at_step("AT+CGATT=0", at_port, 3)
 
-            # Step 9: Reattach to packet network
-            print("  📡 Reattaching to packet network...")
-            ser.write(b"AT+CGATT=1\r\n")
-            time.sleep(3)
-            ser.read_all()
+        # Step 3: Network deregistration (forces clean disconnect)
+        print("  📡 Deregistering from network...")
+        at_step("AT+COPS=2", at_port, 3)
 
-            # Step 10: Reactivate PDP context with new settings
-            print("  📡 Reactivating PDP context...")
-            ser.write(b"AT+CGACT=1,1\r\n")
-            time.sleep(3)
-            ser.read_all()
+        # Step 4: Wait for carrier to forget us (critical for sticky CGNAT)
+        print(f"  ⏱️ Waiting {wait_seconds}s for carrier to release IP assignment...")
+        time.sleep(max(20, wait_seconds))
+
+        # Step 5: Switch network mode (4G -> 3G -> 4G for new IP pool)
+        print("  📡 Switching to 3G mode...")
+        at_step("AT+CNMP=14", at_port, 4)  # 3G only
+
+        # Step 6: Switch back to 4G mode (forces re-registration)
+        print("  📡 Switching back to 4G mode...")
+        at_step("AT+CNMP=38", at_port, 4)  # 4G only (LTE preferred)
+
+        # Step 7: Try APN cycling (sometimes triggers new IP pool)
+        print("  📡 Cycling APN for fresh IP pool...")
+        at_step('AT+CGDCONT=1,"IP","eesecure"', at_port, 2)  # Switch to eesecure
+
+        at_step('AT+CGDCONT=1,"IP","everywhere"', at_port, 2)  # Back to everywhere
+
+        # Step 8: Auto-register to network
+        print("  📡 Auto-registering to network...")
+        at_step("AT+COPS=0", at_port, 5)
+
+        # Step 9: Reattach to packet network
+        print("  📡 Reattaching to packet network...")
+        at_step("AT+CGATT=1", at_port, 3)
+
+        # Step 10: Reactivate PDP context with new settings
+        print("  📡 Reactivating PDP context...")
+        at_step("AT+CGACT=1,1", at_port, 3)
 
         print("  ✅ Smart IP rotation complete (aggressive mode)")
         return True
@@ -1072,63 +1414,47 @@ def deep_reset_rndis_modem(randomise_imei_enabled=False, wait_seconds=60):
             print(f"⚠️ Deep reset skipped: AT port {at_port} not available")
             return False
 
-        with serial.Serial(at_port, 115200, timeout=5) as ser:
-            # Deactivate PDP context
-            print("  📡 Deactivating PDP context...")
-            ser.write(b"AT+CGACT=0,1\r\n")
-            time.sleep(2)
-            ser.read_all()
+        # Deactivate PDP context
+        print("  📡 Deactivating PDP context...")
+        at_step("AT+CGACT=0,1", at_port, 2)
 
-            # Detach from network
-            print("  📡 Detaching from network...")
-            ser.write(b"AT+CGATT=0\r\n")
-            time.sleep(2)
-            ser.read_all()
-            
-            # Deregister from network
-            print("  ✈️ Deregistering from network...")
-            ser.write(b"AT+COPS=2\r\n")
-            time.sleep(3)
-            ser.read_all()
+        # Detach from network
+        print("  📡 Detaching from network...")
+        at_step("AT+CGATT=0", at_port, 2)
 
-            # Airplane mode
-            print("  ✈️ Airplane mode...")
-            ser.write(b"AT+CFUN=4\r\n")
-            time.sleep(3)
-            ser.read_all()
+        # Deregister from network
+        print("  ✈️ Deregistering from network...")
+        at_step("AT+COPS=2", at_port, 3)
 
-            # Wait in airplane mode
-            print(f"  ⏱️ Wait in airplane mode ({wait_seconds}s)...")
-            time.sleep(wait_seconds)
+        # Airplane mode
+        print("  ✈️ Airplane mode...")
+        at_step("AT+CFUN=4", at_port, 3)
 
-            # Radio back on
-            print("  📡 Radio back on...")
-            ser.write(b"AT+CFUN=1\r\n")
-            time.sleep(8)
-            ser.read_all()
-            
-            # Auto-register
-            print("  📡 Auto-registering...")
-            ser.write(b"AT+COPS=0\r\n")
-            time.sleep(5)
-            ser.read_all()
+        # Wait in airplane mode
+        print(f"  ⏱️ Wait in airplane mode ({wait_seconds}s)...")
+        time.sleep(wait_seconds)
 
-            # Reattach
-            print("  📡 Reattaching...")
-            ser.write(b"AT+CGATT=1\r\n")
-            time.sleep(2)
-            ser.read_all()
+        # Radio back on
+        print("  📡 Radio back on...")
+        at_step("AT+CFUN=1", at_port, 8)
 
-            # Reactivate
-            print("  📡 Reactivating PDP...")
-            ser.write(b"AT+CGACT=1,1\r\n")
-            time.sleep(2)
-            ser.read_all()
+        # Auto-register
+        print("  📡 Auto-registering...")
+        at_step("AT+COPS=0", at_port, 5)
+
+        # Reattach
+        print("  📡 Reattaching...")
+        at_step("AT+CGATT=1", at_port, 2)
+
+        # Reactivate
+        print("  📡 Reactivating PDP...")
+        at_step("AT+CGACT=1,1", at_port, 2)
 
         print("  ✅ Deep modem reset complete")
         return True
     except Exception as e:
         print(f"  ⚠️ Deep modem reset failed: {e}")
+        _drop_serial()
         return False
 
 def teardown_rndis(wait_s: int, deep_reset: bool = False, randomise_imei_enabled: bool = False, deep_reset_wait: int = 60):
@@ -1165,8 +1491,7 @@ def teardown_rndis(wait_s: int, deep_reset: bool = False, randomise_imei_enabled
         
         # Step 4: Finally bring interface down
         print(f"  📡 Bringing interface down...")
-        subprocess.run([SUDO_PATH, "-n", IP_PATH, "link", "set", "dev", iface, "down"],
-                       capture_output=True, text=True, check=False)
+        link_set(iface, "down")
         
         # Step 5: Wait for carrier to forget us
         print(f"  ⏱️ Waiting {wait_s} seconds for carrier to release IP pool assignment...")
@@ -1174,6 +1499,19 @@ def teardown_rndis(wait_s: int, deep_reset: bool = False, randomise_imei_enabled
     else:
         print("No RNDIS interface found, skipping teardown")
 
+def wait_for_carrier(iface, timeout_s=2.0):
+    """Wait briefly for iface to report carrier after link up."""
+    operstate = Path("/sys/class/net") / iface / "operstate"
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        try:
+            if operstate.read_text().strip() in ("up", "unknown"):
+                return True
+        except OSError:
+            return False
+        time.sleep(0.1)
+    return False
+
 def start_rndis():
     """Start RNDIS interface by bringing it up and requesting NEW IP via DHCP."""
     iface, has_ip = detect_rndis_interface()
@@ -1183,18 +1521,16 @@ def start_rndis():
     print(f"Starting RNDIS interface: {iface}")
     
     # Step 1: Ensure interface is down first (clean slate)
-    subprocess.run([SUDO_PATH, "-n", IP_PATH, "link", "set", "dev", iface, "down"],
-                   capture_output=True, text=True, check=False)
+    link_set(iface, "down")
     time.sleep(1)
     
     # Step 2: Bring interface up
     print(f"  📡 Bringing interface up...")
-    res = subprocess.run([SUDO_PATH, "-n", IP_PATH, "link", "set", "dev", iface, "up"],
-                         capture_output=True, text=True, check=False)
+    res = link_set(iface, "up")
     if res.returncode != 0:
         raise RuntimeError(f"Failed to bring up {iface}: {res.stderr.strip()}")
     
-    time.sleep(3)
+    wait_for_carrier(iface)
     
     # Step 3: Kill any existing dhclient for this interface
     print(f"  📡 Killing any existing dhclient processes...")
@@ -1222,8 +1558,7 @@ def start_rndis():
         if res.returncode != 0:
             raise RuntimeError(f"DHCP failed for {iface}: {res.stderr.strip()}")
     
-    # Step 6: Verify we got an IP
-    time.sleep(2)
+    # Step 6: Verify we got an IP (dhclient only returns once it has a lease)
     _, has_ip = detect_rndis_interface()
     if not has_ip:
         raise RuntimeError(f"Interface {iface} came up but has no IP address")
@@ -1233,40 +1568,240 @@ def start_rndis():
 
 def wait_for_rndis_up(timeout_s: int) -> bool:
     """Wait for RNDIS interface to get an IP address."""
-    deadline = time.time() + max(5, int(timeout_s))
-    while time.time() < deadline:
-        iface, has_ip = detect_rndis_interface()
-        if iface and has_ip:
-            return True
-        time.sleep(2)
-    return False
+    return _wait_for_event(lambda: all(detect_rndis_interface()), max(5, int(timeout_s)))
 
 # ========= PPP helpers (fallback) =========
 
 def teardown_ppp(wait_s: int):
-    subprocess.run([SUDO_PATH, "-n", PKILL_PATH, "pppd"], check=False)
+    subprocess.run(PPP_KILL_CMD, check=False)
     print(f"Waiting {wait_s} seconds for PPP teardown...")
     time.sleep(max(1, int(wait_s)))
 
 def start_ppp():
-    res = subprocess.run([SUDO_PATH, "-n", PPPD_PATH, "call", "ee"],
+    res = subprocess.run(PPP_CALL_CMD,
                          capture_output=True, text=True, timeout=60, check=False)
     if res.returncode != 0:
         raise RuntimeError(f"PPP start failed: {res.stderr.strip() or res.stdout.strip()}")
 
 def wait_for_ppp_up(timeout_s: int) -> bool:
-    deadline = time.time() + max(5, int(timeout_s))
-    while time.time() < deadline:
-        r = subprocess.run([IP_PATH, "-4", "addr", "show", "ppp0"],
-                           capture_output=True, text=True)
-        if r.returncode == 0 and "inet " in r.stdout:
-            return True
-        time.sleep(2)
-    return False
+    return _wait_for_event(lambda: iface_ipv4("ppp0") is not None, max(5, int(timeout_s)))
+
+# ========= Rotation =========
+
+def _finalize_rotation(label, previous_ip, public_ip, attempts=None, err=None, status_code=200, **extra):
+    """Log and notify the outcome of a rotation; returns (result, http_status)."""
+    if err is None:
+        log.info("✅ %s successful on attempt %d: %s -> %s", label, attempts, previous_ip, public_ip)
+        send_discord_notification(public_ip, previous_ip, is_rotation=True)
+        result = {'status': 'success'}
+    else:
+        log.error("%s failed: %s", label, err)
+        # The IP didn't move, so the failure embed shows the IP we started with
+        send_discord_notification(previous_ip, previous_ip, is_rotation=False, is_failure=True, error_message=err)
+        result = {'status': 'failed', 'error': err}
+    result.update(extra, public_ip=public_ip, previous_ip=previous_ip)
+    if attempts is not None:
+        result['attempts'] = attempts
+    return result, status_code
+
+def perform_rotation(config, previous_ip, label="IP rotation"):
+    """
+    Rotate the public IP on whichever cellular link is in use
+    (teardown -> restart -> wait -> verify), retrying up to max_attempts.
+
+    Updates IP history and sends the Discord notification for the outcome.
+    Returns (result, http_status) where result is the /rotate JSON body.
+    """
+    # Get configured modem mode
+    modem_mode = config.get('modem', {}).get('mode', 'auto')
+    log.info("Modem mode: %s", modem_mode)
+
+    cfg = load_rotation_cfg()
+    teardown_wait = cfg.teardown_wait
+    restart_wait  = cfg.restart_wait
+    max_attempts  = cfg.max_attempts
+    randomise_imei_enabled = cfg.randomise_imei
+
+    # Check available interfaces
+    qmi_iface, qmi_has_ip = detect_qmi_interface()
+    rndis_iface, rndis_has_ip = detect_rndis_interface()
+
+    # Determine which mode to use based on config and availability
+    use_qmi = False
+    use_rndis = False
+
+    if modem_mode == "qmi":
+        use_qmi = True
+    elif modem_mode == "rndis":
+        use_rndis = True
+    elif modem_mode == "ppp":
+        use_qmi = False
+        use_rndis = False
+    elif modem_mode == "auto":
+        # Auto priority: QMI > RNDIS > PPP
+        if qmi_iface:
+            use_qmi = True
+        elif rndis_iface:
+            use_rndis = True
+
+    # ===== QMI path =====
+    if use_qmi and qmi_iface:
+        link = "QMI"
+        log.info("Using QMI interface: %s", qmi_iface)
+        log.info("QMI rotation config: teardown_wait=%ss, restart_wait=%ss, max_attempts=%s, randomise_imei=%s",
+                 teardown_wait, restart_wait, max_attempts, 'enabled' if randomise_imei_enabled else 'disabled')
+
+        def teardown(attempt):
+            # Always use deep reset for better IP variety with sticky CGNAT
+            log.info("Using deep reset for better IP variety (sticky CGNAT workaround)")
+            teardown_qmi(teardown_wait, deep_reset=True, randomise_imei_enabled=randomise_imei_enabled)
+
+        start, wait_up = start_qmi, wait_for_qmi_up
+
+    # ===== RNDIS path =====
+    elif use_rndis and rndis_iface:
+        link = "RNDIS"
+        deep_reset_wait = cfg.deep_wait if cfg.deep_wait is not None else 60
+        log.info("Using RNDIS interface: %s", rndis_iface)
+        log.info("RNDIS rotation config: teardown_wait=%ss, restart_wait=%ss, max_attempts=%s, deep_reset_wait=%ss, randomise_imei=%s",
+                 teardown_wait, restart_wait, max_attempts, deep_reset_wait, 'enabled' if randomise_imei_enabled else 'disabled')
+
+        def teardown(attempt):
+            # Always use deep reset for better IP variety with sticky CGNAT
+            log.info("Using deep reset for better IP variety (sticky CGNAT workaround)")
+            teardown_rndis(teardown_wait, deep_reset=True, randomise_imei_enabled=randomise_imei_enabled, deep_reset_wait=deep_reset_wait)
+
+        start, wait_up = start_rndis, wait_for_rndis_up
+
+    # ===== PPP fallback =====
+    else:
+        link = "PPP"
+        log.info("No RNDIS interface found, using PPP fallback")
+
+        deep_enabled = cfg.deep_enabled
+        deep_method  = cfg.deep_method
+        deep_wait = cfg.deep_wait if cfg.deep_wait is not None else 180
+
+        log.info("PPP rotation config: teardown_wait=%ss, restart_wait=%ss, max_attempts=%s, deep_reset=%s (%s, %ss)",
+                 teardown_wait, restart_wait, max_attempts, 'enabled' if deep_enabled else 'disabled', deep_method, deep_wait)
+
+        def teardown(attempt):
+            if attempt == 0:
+                teardown_ppp(teardown_wait)
+                log.info("Attempt 1: Simple PPP restart")
+            elif deep_enabled:
+                # The deep reset's detach wait doubles as the teardown settle
+                # time, so only sleep for whatever part of it is left over
+                log.info("Attempt %d: Deep reset (%s) before PPP", attempt + 1, deep_method)
+                t0 = time.monotonic()
+                teardown_ppp(0)
+                deep_reset_modem(deep_method, deep_wait)
+                remaining = teardown_wait - (time.monotonic() - t0)
+                if remaining > 0:
+                    time.sleep(remaining)
+                log.info("Waiting up to 15s for modem ports to re-enumerate…")
+                wait_for_tty_usb(15)
+            else:
+                teardown_ppp(teardown_wait)
+                log.info("Attempt %d: Deep reset disabled; trying PPP restart again", attempt + 1)
+
+        start, wait_up = start_ppp, wait_for_ppp_up
+
+    for attempt in range(max_attempts):
+        log.info("\n--- %s Rotation Attempt %d/%d ---", link, attempt + 1, max_attempts)
+
+        teardown(attempt)
+
+        try:
+            start()
+        except Exception as e:
+            log.warning("%s restart failed on attempt %d: %s", link, attempt + 1, e)
+            if attempt == max_attempts - 1:
+                return _finalize_rotation(label, previous_ip, previous_ip, status_code=500,
+                                          err=f"{link} restart failed after {max_attempts} attempts")
+            continue
+
+        invalidate_public_ip()
+
+        total_wait = restart_wait
+        if link == "PPP" and attempt > 0:
+            total_wait += max(30, restart_wait)
+        log.info("Waiting %d seconds for new IP assignment...", total_wait)
+        if not wait_up(total_wait):
+            log.warning("%s interface did not come up within %d seconds", link, total_wait)
+            if attempt == max_attempts - 1:
+                return _finalize_rotation(label, previous_ip, previous_ip, status_code=500,
+                                          err=f"{link} interface failed to get IP after {max_attempts} attempts")
+            continue
+
+        if link == "PPP":
+            log.info("Fixing routing to prefer primary and keep PPP as secondary...")
+            ensure_ppp_default_route()
+
+            # Re-apply policy routing after PPP restart
+            _apply_ppp_policy_routing()
+
+        # Check if IP changed (bypasses the in-progress guard in get_current_ip)
+        new_ip = lookup_public_ip()
+
+        # Update IP history regardless of success/failure
+        if new_ip != "Unknown":
+            update_ip_history(new_ip)
+
+        if new_ip != previous_ip and new_ip != "Unknown":
+            # PDP address is only reported for PPP, and only once it has worked
+            extra = {'pdp': at('AT+CGPADDR')} if link == "PPP" else {}
+            return _finalize_rotation(label, previous_ip, new_ip, attempts=attempt + 1, **extra)
+
+        log.info("IP unchanged on attempt %d: %s (was %s)", attempt + 1, new_ip, previous_ip)
+        if attempt < max_attempts - 1:
+            log.info("Trying next attempt...")
+            continue
+        # Force add to history even though IP is same (to show failed rotation attempt)
+        update_ip_history(new_ip, force_add=True, is_failure=True)
+        extra = {'pdp': ""} if link == "PPP" else {}
+        return _finalize_rotation(label, previous_ip, new_ip, attempts=max_attempts, status_code=400,
+                                  err=f"IP did not change after {max_attempts} attempts", **extra)
 
 # ========= Prevent concurrent rotates =========
+# rotate_lock is held for the whole of a rotation (manual or automatic), so
+# "in progress" is simply rotate_lock.locked(). Each rotation gets an id so a
+# timeout or force-clear can't release a lock taken by a later rotation.
+ROTATION_TIMEOUT_SECONDS = 300
 rotate_lock = threading.Lock()
-in_progress = False
+_rotation_state_lock = threading.Lock()
+_rotation = {"id": 0, "source": None, "started": None}
+
+def rotation_in_progress():
+    return rotate_lock.locked()
+
+def begin_rotation(source):
+    """Take the rotation lock without blocking; returns a rotation id, or None if busy."""
+    if not rotate_lock.acquire(blocking=False):
+        return None
+    with _rotation_state_lock:
+        _rotation["id"] += 1
+        _rotation.update(source=source, started=time.time())
+        return _rotation["id"]
+
+def end_rotation(rotation_id):
+    """Release the rotation lock if rotation_id is still the active rotation."""
+    with _rotation_state_lock:
+        if rotation_id != _rotation["id"] or not rotate_lock.locked():
+            return False
+        _rotation.update(source=None, started=None)
+        rotate_lock.release()
+        return True
+
+def rotation_progress():
+    """Snapshot of the current rotation for status endpoints."""
+    with _rotation_state_lock:
+        started = _rotation["started"]
+        return {
+            'in_progress': rotate_lock.locked(),
+            'source': _rotation["source"],
+            'elapsed_seconds': int(time.time() - started) if started else None,
+        }
 
 # ========= Auto-rotation timer =========
 auto_rotation_thread = None
@@ -1295,215 +1830,24 @@ def auto_rotation_worker():
                     print("Auto-rotation: Triggering scheduled IP rotation...")
 
                     # Call the rotation function directly (bypass API auth)
+                    rotation_id = begin_rotation("auto")
+                    if rotation_id is None:
+                        print("Auto-rotation: Rotation already in progress, skipping this cycle")
+                        continue
                     try:
-                        current_ip = get_current_ip()
-                        previous_ip = current_ip
-
-                        # Get configured modem mode
-                        modem_mode = config.get('modem', {}).get('mode', 'auto')
-
-                        # Check available interfaces
-                        qmi_iface, qmi_has_ip = detect_qmi_interface()
-                        rndis_iface, rndis_has_ip = detect_rndis_interface()
-
-                        # Determine which mode to use
-                        use_qmi = False
-                        use_rndis = False
-                        if modem_mode == "qmi":
-                            use_qmi = True
-                        elif modem_mode == "rndis":
-                            use_rndis = True
-                        elif modem_mode == "ppp":
-                            use_qmi = False
-                            use_rndis = False
-                        elif modem_mode == "auto":
-                            # Auto priority: QMI > RNDIS > PPP
-                            if qmi_iface:
-                                use_qmi = True
-                            elif rndis_iface:
-                                use_rndis = True
-
-                        if use_qmi and qmi_iface:
-                            print(f"Auto-rotation: Using QMI interface: {qmi_iface}")
-                            rotation_config = config.get('rotation', {}) or {}
-                            teardown_wait = int(rotation_config.get('ppp_teardown_wait', 30))
-                            restart_wait  = int(rotation_config.get('ppp_restart_wait', 60))
-                            max_attempts  = int(rotation_config.get('max_attempts', 2))
-                            randomise_imei_enabled = rotation_config.get('randomise_imei', False)
-
-                            for attempt in range(max_attempts):
-                                print(f"Auto-rotation: QMI Rotation Attempt {attempt + 1}/{max_attempts}")
-
-                                # Always use deep reset for better IP variety with sticky CGNAT
-                                use_deep_reset = True
-                                print(f"Auto-rotation: Using deep reset for better IP variety")
-
-                                teardown_qmi(teardown_wait, deep_reset=use_deep_reset, randomise_imei_enabled=randomise_imei_enabled)
-
-                                try:
-                                    start_qmi()
-                                except Exception as e:
-                                    print(f"Auto-rotation: QMI restart failed on attempt {attempt + 1}: {e}")
-                                    if attempt == max_attempts - 1:
-                                        err = f"QMI restart failed after {max_attempts} attempts"
-                                        print(f"Auto-rotation failed: {err}")
-                                        send_discord_notification(current_ip, previous_ip, is_rotation=False, is_failure=True, error_message=err)
-                                        continue
-                                    continue
-
-                                if not wait_for_qmi_up(restart_wait):
-                                    print(f"Auto-rotation: QMI interface did not come up within {restart_wait} seconds")
-                                    if attempt == max_attempts - 1:
-                                        err = f"QMI interface failed to get IP after {max_attempts} attempts"
-                                        print(f"Auto-rotation failed: {err}")
-                                        send_discord_notification(current_ip, previous_ip, is_rotation=False, is_failure=True, error_message=err)
-                                        continue
-                                    continue
-
-                                # Check if IP changed
-                                time.sleep(5)  # Give it a moment to stabilize
-                                new_ip = get_current_ip()
-
-                                # Update IP history regardless of success/failure
-                                if new_ip != "Unknown":
-                                    update_ip_history(new_ip)
-
-                                if new_ip != previous_ip and new_ip != "Unknown":
-                                    print(f"✅ Auto-rotation successful: {previous_ip} -> {new_ip}")
-                                    send_discord_notification(new_ip, previous_ip, is_rotation=True)
-                                    break
-                                else:
-                                    print(f"Auto-rotation: IP unchanged on attempt {attempt + 1}: {new_ip} (was {previous_ip})")
-                                    if attempt < max_attempts - 1:
-                                        continue
-                                    err = f"IP did not change after {max_attempts} attempts"
-                                    print(f"Auto-rotation failed: {err}")
-                                    # Force add to history even though IP is same (to show failed rotation attempt)
-                                    update_ip_history(new_ip, force_add=True, is_failure=True)
-                                    send_discord_notification(current_ip, previous_ip, is_rotation=False, is_failure=True, error_message=err)
-
-                        elif use_rndis and rndis_iface:
-                            print(f"Auto-rotation: Using RNDIS interface: {rndis_iface}")
-                            rotation_config = config.get('rotation', {}) or {}
-                            teardown_wait = int(rotation_config.get('ppp_teardown_wait', 30))
-                            restart_wait  = int(rotation_config.get('ppp_restart_wait', 60))
-                            max_attempts  = int(rotation_config.get('max_attempts', 2))
-                            randomise_imei_enabled = rotation_config.get('randomise_imei', False)
-                            deep_reset_wait = int(rotation_config.get('deep_reset_wait', 60))
-
-                            for attempt in range(max_attempts):
-                                print(f"Auto-rotation: RNDIS Rotation Attempt {attempt + 1}/{max_attempts}")
-
-                                # Always use deep reset for better IP variety with sticky CGNAT
-                                use_deep_reset = True
-                                print(f"Auto-rotation: Using deep reset for better IP variety")
-
-                                teardown_rndis(teardown_wait, deep_reset=use_deep_reset, randomise_imei_enabled=randomise_imei_enabled, deep_reset_wait=deep_reset_wait)
-
-                                try:
-                                    start_rndis()
-                                except Exception as e:
-                                    print(f"Auto-rotation: RNDIS restart failed on attempt {attempt + 1}: {e}")
-                                    if attempt == max_attempts - 1:
-                                        err = f"RNDIS restart failed after {max_attempts} attempts"
-                                        print(f"Auto-rotation failed: {err}")
-                                        send_discord_notification(current_ip, previous_ip, is_rotation=False, is_failure=True, error_message=err)
-                                        continue
-                                    continue
-
-                                if not wait_for_rndis_up(restart_wait):
-                                    print(f"Auto-rotation: RNDIS interface did not come up within {restart_wait} seconds")
-                                    if attempt == max_attempts - 1:
-                                        err = f"RNDIS interface failed to get IP after {max_attempts} attempts"
-                                        print(f"Auto-rotation failed: {err}")
-                                        send_discord_notification(current_ip, previous_ip, is_rotation=False, is_failure=True, error_message=err)
-                                        continue
-                                    continue
-
-                                # Check if IP changed
-                                time.sleep(5)  # Give it a moment to stabilize
-                                new_ip = get_current_ip()
-
-                                # Update IP history regardless of success/failure
-                                if new_ip != "Unknown":
-                                    update_ip_history(new_ip)
-
-                                if new_ip != previous_ip and new_ip != "Unknown":
-                                    print(f"✅ Auto-rotation successful: {previous_ip} -> {new_ip}")
-                                    send_discord_notification(new_ip, previous_ip, is_rotation=True)
-                                    break
-                                else:
-                                    print(f"Auto-rotation: IP unchanged on attempt {attempt + 1}: {new_ip} (was {previous_ip})")
-                                    if attempt < max_attempts - 1:
-                                        continue
-                                    err = f"IP did not change after {max_attempts} attempts"
-                                    print(f"Auto-rotation failed: {err}")
-                                    # Force add to history even though IP is same (to show failed rotation attempt)
-                                    update_ip_history(new_ip, force_add=True, is_failure=True)
-                                    send_discord_notification(current_ip, previous_ip, is_rotation=False, is_failure=True, error_message=err)
-                        else:
-                            print("Auto-rotation: No QMI/RNDIS interfaces found, trying PPP fallback...")
-                            # PPP fallback logic (similar to manual rotation)
-                            rotation_config = config.get('rotation', {}) or {}
-                            teardown_wait = int(rotation_config.get('ppp_teardown_wait', 30))
-                            restart_wait = int(rotation_config.get('ppp_restart_wait', 60))
-                            max_attempts = int(rotation_config.get('max_attempts', 2))
-
-                            for attempt in range(max_attempts):
-                                print(f"Auto-rotation: PPP Rotation Attempt {attempt + 1}/{max_attempts}")
-                                
-                                teardown_ppp(teardown_wait)
-                                
-                                try:
-                                    start_ppp()
-                                except Exception as e:
-                                    print(f"Auto-rotation: PPP restart failed on attempt {attempt + 1}: {e}")
-                                    if attempt == max_attempts - 1:
-                                        err = f"PPP restart failed after {max_attempts} attempts"
-                                        print(f"Auto-rotation failed: {err}")
-                                        send_discord_notification(current_ip, previous_ip, is_rotation=False, is_failure=True, error_message=err)
-                                        break
-                                    continue
-
-                                if not wait_for_ppp_up(restart_wait):
-                                    print(f"Auto-rotation: PPP interface did not come up within {restart_wait} seconds")
-                                    if attempt == max_attempts - 1:
-                                        err = f"PPP interface failed to get IP after {max_attempts} attempts"
-                                        print(f"Auto-rotation failed: {err}")
-                                        send_discord_notification(current_ip, previous_ip, is_rotation=False, is_failure=True, error_message=err)
-                                        break
-                                    continue
-
-                                # Check if IP changed
-                                time.sleep(5)  # Give it a moment to stabilize
-                                new_ip = get_current_ip()
-
-                                # Update IP history regardless of success/failure
-                                if new_ip != "Unknown":
-                                    update_ip_history(new_ip)
-
-                                if new_ip != previous_ip and new_ip != "Unknown":
-                                    print(f"✅ Auto-rotation successful: {previous_ip} -> {new_ip}")
-                                    send_discord_notification(new_ip, previous_ip, is_rotation=True)
-                                    break
-                                else:
-                                    print(f"Auto-rotation: IP unchanged on attempt {attempt + 1}: {new_ip} (was {previous_ip})")
-                                    if attempt < max_attempts - 1:
-                                        continue
-                                    err = f"IP did not change after {max_attempts} attempts"
-                                    print(f"Auto-rotation failed: {err}")
-                                    # Force add to history even though IP is same (to show failed rotation attempt)
-                                    update_ip_history(new_ip, force_add=True, is_failure=True)
-                                    send_discord_notification(current_ip, previous_ip, is_rotation=False, is_failure=True, error_message=err)
+                        current_ip = lookup_public_ip()
+                        perform_rotation(config, current_ip, label="Auto-rotation")
 
                     except Exception as e:
                         err = f"Auto-rotation failed: {str(e)}"
                         print(f"Auto-rotation error: {err}")
                         try:
-                            current_ip = get_current_ip()
+                            current_ip = lookup_public_ip()
                         except Exception:
                             current_ip = "Unknown"
                         send_discord_notification(current_ip, None, is_rotation=False, is_failure=True, error_message=err)
+                    finally:
+                        end_rotation(rotation_id)
             else:
                 # If disabled or interval is 0, wait longer and check again
                 time.sleep(60)
@@ -1542,46 +1886,46 @@ def set_auto_rotation_enabled(enabled):
 
 # ========= API =========
 
+# Endpoints that require the API token (Authorization: Bearer <token>)
+PROTECTED_ENDPOINTS = {'rotate', 'notify', 'history', 'test_failure', 'auto_rotation'}
+
+@app.before_request
+def _check_auth():
+    if request.endpoint not in PROTECTED_ENDPOINTS:
+        return
+    if request.endpoint == 'auto_rotation' and request.view_args.get('action') == 'status':
+        return
+    load_config()  # refreshes API_TOKEN if config.yaml changed
+    token = request.headers.get('Authorization', '')
+    if token.startswith('Bearer '):
+        token = token[7:]
+    if not API_TOKEN or not hmac.compare_digest(token.encode(), API_TOKEN.encode()):
+        abort(403)
+
+_status_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="status")
+
 @app.get('/status')
 def status():
     # Fast status check with actual IP detection
     pdp = "N/A"  # Skip slow AT command
     
-    # Detect which connection mode is active
-    connection_mode = "Unknown"
-    interface_name = "Unknown"
-    up = False
+    # Detect which connection mode is active (local interface state only)
+    connection_mode, interface_name, local_ip = get_local_cellular_ip()
+    up = connection_mode is not None
 
-    try:
-        # Check QMI first
-        qmi_iface, qmi_has_ip = detect_qmi_interface()
-        if qmi_iface and qmi_has_ip:
-            connection_mode = "QMI"
-            interface_name = qmi_iface
-            up = True
-        else:
-            # Check RNDIS
-            rndis_iface, rndis_has_ip = detect_rndis_interface()
-            if rndis_iface and rndis_has_ip:
-                connection_mode = "RNDIS"
-                interface_name = rndis_iface
-                up = True
-            else:
-                # Check PPP
-                r = subprocess.run([IP_PATH, "-4", "addr", "show", "ppp0"],
-                                   capture_output=True, text=True, timeout=3)
-                if r.returncode == 0 and "inet " in r.stdout:
-                    connection_mode = "PPP"
-                    interface_name = "ppp0"
-                    up = True
-    except Exception:
-        pass
+    net_future = _status_pool.submit(get_network_type)
 
-    # Get public IP (with timeout to avoid hanging)
-    try:
-        pub = get_current_ip()
-    except Exception as e:
-        pub = f"Error: {str(e)[:30]}"
+    # Public IP comes from the background refresher; only go out to the
+    # proxy when asked to (?refresh=1) or before the first lookup landed
+    if rotation_in_progress():
+        pub = "Rotating..."
+    elif request.args.get('refresh') or not _ip_cache["ts"]:
+        try:
+            pub = _status_pool.submit(get_current_ip).result()
+        except Exception as e:
+            pub = f"Error: {str(e)[:30]}"
+    else:
+        pub = _ip_cache["ip"]
 
     # Skip slow IMEI checks for fast status
     current_imei = "N/A"
@@ -1591,11 +1935,12 @@ def status():
     return jsonify({
         'pdp': pdp,
         'public_ip': pub,
+        'local_ip': local_ip or "Unknown",
         'ppp_up': up,  # Keep for backwards compatibility
-        'connection_mode': connection_mode,
-        'interface': interface_name,
+        'connection_mode': connection_mode or "Unknown",
+        'interface': interface_name or "Unknown",
         'connected': up,
-        'network_type': get_network_type(),
+        'network_type': net_future.result(),
         'imei': {
             'current': current_imei,
             'original': original_imei,
@@ -1605,371 +1950,44 @@ def status():
 
 @app.post('/rotate')
 def rotate():
-    global in_progress
-    if not rotate_lock.acquire(blocking=False):
+    rotation_id = begin_rotation("api")
+    if rotation_id is None:
         return jsonify({'status': 'busy', 'message': 'rotation already in progress'}), 429
-    in_progress = True
-    
+
     # Use threading timeout instead of signal (works in Flask threads)
-    import threading
-    import time
-    
     def timeout_worker():
-        time.sleep(300)  # 5 minutes
-        global in_progress
-        if in_progress:
+        time.sleep(ROTATION_TIMEOUT_SECONDS)
+        if end_rotation(rotation_id):
             print("⚠️ Rotation timed out after 5 minutes - forcing completion")
-            in_progress = False
-            try:
-                rotate_lock.release()
-            except:
-                pass
-    
+
     timeout_thread = threading.Thread(target=timeout_worker, daemon=True)
     timeout_thread.start()
     
     try:
         config = load_config()
-        expected = config['api']['token']
-        token = request.headers.get('Authorization', '')
-        if expected not in token:
-            abort(403)
-
-        current_ip = get_current_ip()
-        previous_ip = current_ip
-
-        print("Starting IP rotation...")
-
-        # Get configured modem mode
-        modem_mode = config.get('modem', {}).get('mode', 'auto')
-        print(f"Modem mode: {modem_mode}")
-
-        # Check available interfaces
-        qmi_iface, qmi_has_ip = detect_qmi_interface()
-        rndis_iface, rndis_has_ip = detect_rndis_interface()
-
-        # Determine which mode to use based on config and availability
-        use_qmi = False
-        use_rndis = False
-
-        if modem_mode == "qmi":
-            use_qmi = True
-        elif modem_mode == "rndis":
-            use_rndis = True
-        elif modem_mode == "ppp":
-            use_qmi = False
-            use_rndis = False
-        elif modem_mode == "auto":
-            # Auto priority: QMI > RNDIS > PPP
-            if qmi_iface:
-                use_qmi = True
-            elif rndis_iface:
-                use_rndis = True
-
-        # ===== QMI path =====
-        if use_qmi and qmi_iface:
-            print(f"Using QMI interface: {qmi_iface}")
-            rotation_config = config.get('rotation', {}) or {}
-            teardown_wait = int(rotation_config.get('ppp_teardown_wait', 30))
-            restart_wait  = int(rotation_config.get('ppp_restart_wait', 60))
-            max_attempts  = int(rotation_config.get('max_attempts', 2))
-            randomise_imei_enabled = rotation_config.get('randomise_imei', False)
-
-            print(f"QMI rotation config: teardown_wait={teardown_wait}s, restart_wait={restart_wait}s, max_attempts={max_attempts}, randomise_imei={'enabled' if randomise_imei_enabled else 'disabled'}")
-
-            for attempt in range(max_attempts):
-                print(f"\n--- QMI Rotation Attempt {attempt + 1}/{max_attempts} ---")
-
-                # Always use deep reset for better IP variety with sticky CGNAT
-                use_deep_reset = True
-                print(f"Using deep reset for better IP variety (sticky CGNAT workaround)")
-
-                teardown_qmi(teardown_wait, deep_reset=use_deep_reset, randomise_imei_enabled=randomise_imei_enabled)
-
-                try:
-                    start_qmi()
-                except Exception as e:
-                    print(f"QMI restart failed on attempt {attempt + 1}: {e}")
-                    if attempt == max_attempts - 1:
-                        err = f"QMI restart failed after {max_attempts} attempts"
-                        print(f"IP rotation failed: {err}")
-                        send_discord_notification(current_ip, previous_ip, is_rotation=False, is_failure=True, error_message=err)
-                        return jsonify({'status': 'failed', 'error': err, 'public_ip': current_ip, 'previous_ip': previous_ip}), 500
-                    continue
-
-                total_wait = restart_wait
-                print(f"Waiting {total_wait} seconds for new IP assignment...")
-                if not wait_for_qmi_up(total_wait):
-                    print(f"QMI interface did not come up within {total_wait} seconds")
-                    if attempt == max_attempts - 1:
-                        err = f"QMI interface failed to get IP after {max_attempts} attempts"
-                        print(f"IP rotation failed: {err}")
-                        send_discord_notification(current_ip, previous_ip, is_rotation=False, is_failure=True, error_message=err)
-                        return jsonify({'status': 'failed', 'error': err, 'public_ip': current_ip, 'previous_ip': previous_ip}), 500
-                    continue
-
-                # Check if IP changed
-                time.sleep(5)  # Give it a moment to stabilize
-                new_ip = get_current_ip()
-
-                # Update IP history regardless of success/failure
-                if new_ip != "Unknown":
-                    update_ip_history(new_ip)
-
-                if new_ip != previous_ip and new_ip != "Unknown":
-                    print(f"✅ IP rotation successful on attempt {attempt + 1}: {previous_ip} -> {new_ip}")
-                    send_discord_notification(new_ip, previous_ip, is_rotation=True)
-                    return jsonify({
-                        'status': 'success',
-                        'public_ip': new_ip,
-                        'previous_ip': previous_ip,
-                        'attempts': attempt + 1
-                    })
-                else:
-                    print(f"IP unchanged on attempt {attempt + 1}: {new_ip} (was {previous_ip})")
-                    if attempt < max_attempts - 1:
-                        print("Trying next attempt...")
-                        continue
-                    err = f"IP did not change after {max_attempts} attempts"
-                    print(f"IP rotation failed: {err}")
-                    # Force add to history even though IP is same (to show failed rotation attempt)
-                    update_ip_history(new_ip, force_add=True, is_failure=True)
-                    send_discord_notification(current_ip, previous_ip, is_rotation=False, is_failure=True, error_message=err)
-                    return jsonify({
-                        'status': 'failed',
-                        'error': err,
-                        'public_ip': new_ip,
-                        'previous_ip': previous_ip,
-                        'attempts': max_attempts
-                    }), 400
-
-        # ===== RNDIS path =====
-        elif use_rndis and rndis_iface:
-            print(f"Using RNDIS interface: {rndis_iface}")
-            rotation_config = config.get('rotation', {}) or {}
-            teardown_wait = int(rotation_config.get('ppp_teardown_wait', 30))
-            restart_wait  = int(rotation_config.get('ppp_restart_wait', 60))
-            max_attempts  = int(rotation_config.get('max_attempts', 2))
-            randomise_imei_enabled = rotation_config.get('randomise_imei', False)
-            deep_reset_wait = int(rotation_config.get('deep_reset_wait', 60))
-
-            print(f"RNDIS rotation config: teardown_wait={teardown_wait}s, restart_wait={restart_wait}s, max_attempts={max_attempts}, deep_reset_wait={deep_reset_wait}s, randomise_imei={'enabled' if randomise_imei_enabled else 'disabled'}")
-
-            for attempt in range(max_attempts):
-                print(f"\n--- RNDIS Rotation Attempt {attempt + 1}/{max_attempts} ---")
-
-                # Always use deep reset for better IP variety with sticky CGNAT
-                use_deep_reset = True
-                print(f"Using deep reset for better IP variety (sticky CGNAT workaround)")
-
-                teardown_rndis(teardown_wait, deep_reset=use_deep_reset, randomise_imei_enabled=randomise_imei_enabled, deep_reset_wait=deep_reset_wait)
 
-                try:
-                    start_rndis()
-                except Exception as e:
-                    print(f"RNDIS restart failed on attempt {attempt + 1}: {e}")
-                    if attempt == max_attempts - 1:
-                        err = f"RNDIS restart failed after {max_attempts} attempts"
-                        print(f"IP rotation failed: {err}")
-                        send_discord_notification(current_ip, previous_ip, is_rotation=False, is_failure=True, error_message=err)
-                        return jsonify({'status': 'failed', 'error': err, 'public_ip': current_ip, 'previous_ip': previous_ip}), 500
-                    continue
-
-                total_wait = restart_wait
-                print(f"Waiting {total_wait} seconds for new IP assignment...")
-                if not wait_for_rndis_up(total_wait):
-                    print(f"RNDIS interface did not come up within {total_wait} seconds")
-                    if attempt == max_attempts - 1:
-                        err = f"RNDIS interface failed to get IP after {max_attempts} attempts"
-                        print(f"IP rotation failed: {err}")
-                        send_discord_notification(current_ip, previous_ip, is_rotation=False, is_failure=True, error_message=err)
-                        return jsonify({'status': 'failed', 'error': err, 'public_ip': current_ip, 'previous_ip': previous_ip}), 500
-                    continue
-
-                # Check if IP changed
-                time.sleep(5)  # Give it a moment to stabilize
-                new_ip = get_current_ip()
-
-                # Update IP history regardless of success/failure
-                if new_ip != "Unknown":
-                    update_ip_history(new_ip)
-
-                if new_ip != previous_ip and new_ip != "Unknown":
-                    print(f"✅ IP rotation successful on attempt {attempt + 1}: {previous_ip} -> {new_ip}")
-                    send_discord_notification(new_ip, previous_ip, is_rotation=True)
-                    return jsonify({
-                        'status': 'success',
-                        'public_ip': new_ip,
-                        'previous_ip': previous_ip,
-                        'attempts': attempt + 1
-                    })
-                else:
-                    print(f"IP unchanged on attempt {attempt + 1}: {new_ip} (was {previous_ip})")
-                    if attempt < max_attempts - 1:
-                        print("Trying next attempt...")
-                        continue
-                    err = f"IP did not change after {max_attempts} attempts"
-                    print(f"IP rotation failed: {err}")
-                    # Force add to history even though IP is same (to show failed rotation attempt)
-                    update_ip_history(new_ip, force_add=True, is_failure=True)
-                    send_discord_notification(current_ip, previous_ip, is_rotation=False, is_failure=True, error_message=err)
-                    return jsonify({
-                        'status': 'failed',
-                        'error': err,
-                        'public_ip': new_ip,
-                        'previous_ip': previous_ip,
-                        'attempts': max_attempts
-                    }), 400
-
-        # ===== PPP fallback =====
-        else:
-            print("No RNDIS interface found, using PPP fallback")
-            rotation_config = config.get('rotation', {}) or {}
-            teardown_wait = int(rotation_config.get('ppp_teardown_wait', 30))
-            restart_wait  = int(rotation_config.get('ppp_restart_wait', 60))
-            max_attempts  = int(rotation_config.get('max_attempts', 2))
-
-            deep_enabled = rotation_config.get('deep_reset_enabled', False)
-            deep_method  = (rotation_config.get('deep_reset_method', 'mmcli') or 'mmcli').lower()
-            if 'deep_reset' in rotation_config:  # backward compat
-                old = (rotation_config.get('deep_reset', '') or '').lower()
-                if old in ('mmcli', 'at'):
-                    deep_enabled, deep_method = True, old
-                elif old in ('off', ''):
-                    deep_enabled = False
-            deep_wait = int(rotation_config.get('deep_reset_wait', 180))
-
-            print(
-                f"PPP rotation config: teardown_wait={teardown_wait}s, restart_wait={restart_wait}s, "
-                f"max_attempts={max_attempts}, deep_reset={'enabled' if deep_enabled else 'disabled'} ({deep_method}, {deep_wait}s)"
-            )
-
-            for attempt in range(max_attempts):
-                print(f"\n--- PPP Rotation Attempt {attempt + 1}/{max_attempts} ---")
-                teardown_ppp(teardown_wait)
+        current_ip = lookup_public_ip()
 
-                if attempt == 0:
-                    print("Attempt 1: Simple PPP restart")
-                else:
-                    if deep_enabled:
-                        print(f"Attempt {attempt + 1}: Deep reset ({deep_method}) before PPP")
-                        deep_reset_modem(deep_method, deep_wait)
-                        print("Waiting up to 15s for modem ports to re-enumerate…")
-                        t0 = time.time()
-                        while time.time() - t0 < 15:
-                            if any(n.startswith("ttyUSB") for n in os.listdir("/dev")):
-                                break
-                            time.sleep(1)
-                    else:
-                        print(f"Attempt {attempt + 1}: Deep reset disabled; trying PPP restart again")
-
-                try:
-                    start_ppp()
-                except Exception as e:
-                    print(f"PPP restart failed on attempt {attempt + 1}: {e}")
-                    if attempt == max_attempts - 1:
-                        err = f"PPP restart failed after {max_attempts} attempts"
-                        print(f"IP rotation failed: {err}")
-                        send_discord_notification(current_ip, previous_ip, is_rotation=False, is_failure=True, error_message=err)
-                        return jsonify({'status': 'failed', 'error': err, 'public_ip': current_ip, 'previous_ip': previous_ip}), 500
-                    continue
-
-                extra = 0
-                if attempt > 0:
-                    extra = max(30, restart_wait)
-                total_wait = restart_wait + extra
-                print(f"Waiting {total_wait} seconds for new IP assignment...")
-                if not wait_for_ppp_up(total_wait):
-                    print(f"ppp0 interface not up after attempt {attempt + 1}")
-                    if attempt == max_attempts - 1:
-                        err = "ppp0 interface not up after restart"
-                        print(f"IP rotation failed: {err}")
-                        send_discord_notification(current_ip, previous_ip, is_rotation=False, is_failure=True, error_message=err)
-                        return jsonify({'status': 'failed', 'error': err, 'public_ip': current_ip, 'previous_ip': previous_ip}), 500
-                    continue
-
-                print("Fixing routing to prefer primary and keep PPP as secondary...")
-                ensure_ppp_default_route()
-
-                # Re-apply policy routing after PPP restart
-                print("Re-applying policy routing for Squid...")
-                try:
-                    # Ensure PPP routing table exists and has default route
-                    subprocess.run([IP_PATH, "route", "replace", "default", "dev", "ppp0", "table", "ppp"], check=False)
-
-                    # Re-apply policy rule for marked packets
-                    subprocess.run(["ip", "rule", "del", "fwmark", "0x1", "lookup", "ppp"], check=False)
-                    subprocess.run(["ip", "rule", "add", "fwmark", "0x1", "lookup", "ppp", "priority", "1000"], check=False)
-
-                    # Re-apply packet marking rule for proxy user
-                    subprocess.run([
-                        "iptables", "-t", "mangle", "-D", "OUTPUT",
-                        "-m", "owner", "--uid-owner", "proxy",
-                        "-j", "MARK", "--set-mark", "1"
-                    ], check=False)
-                    subprocess.run([
-                        "iptables", "-t", "mangle", "-A", "OUTPUT",
-                        "-m", "owner", "--uid-owner", "proxy",
-                        "-j", "MARK", "--set-mark", "1"
-                    ], check=False)
-                    print("✅ Policy routing re-applied")
-                except Exception as e:
-                    print(f"⚠️ Policy routing re-application failed: {e}")
-
-                # Check if we got a new IP
-                new_ip = get_current_ip()
-                pdp = at('AT+CGPADDR') if new_ip != "Unknown" else ""
-
-                if new_ip != previous_ip and new_ip != "Unknown":
-                    # Success! New IP obtained
-                    print(f"✅ IP rotation successful on attempt {attempt + 1}: {previous_ip} -> {new_ip}")
-                    send_discord_notification(new_ip, previous_ip, is_rotation=True)
-                    return jsonify({
-                        'status': 'success',
-                        'pdp': pdp,
-                        'public_ip': new_ip,
-                        'previous_ip': previous_ip,
-                        'attempts': attempt + 1
-                    })
-                else:
-                    print(f"IP unchanged on attempt {attempt + 1}: {new_ip} (was {previous_ip})")
-                    if attempt < max_attempts - 1:
-                        print("Trying next attempt with escalation…")
-                        continue
-                    err = f"IP did not change after {max_attempts} attempts"
-                    print(f"IP rotation failed: {err}")
-                    send_discord_notification(current_ip, previous_ip, is_rotation=False, is_failure=True, error_message=err)
-                    return jsonify({
-                        'status': 'failed',
-                        'error': err,
-                        'pdp': pdp,
-                        'public_ip': new_ip,
-                        'previous_ip': previous_ip,
-                        'attempts': max_attempts
-                    }), 400
+        log.info("Starting IP rotation...")
+        result, code = perform_rotation(config, current_ip)
+        return jsonify(result), code
 
     except Exception as e:
         err = f"Rotation failed: {str(e)}"
-        print(f"IP rotation failed: {err}")
+        log.error("IP rotation failed: %s", err)
         try:
-            current_ip = get_current_ip()
+            current_ip = lookup_public_ip()
         except Exception:
             current_ip = "Unknown"
         send_discord_notification(current_ip, None, is_rotation=False, is_failure=True, error_message=err)
         return jsonify({'status': 'failed', 'error': err}), 500
     finally:
-        in_progress = False
-        rotate_lock.release()
+        end_rotation(rotation_id)
 
 @app.post('/rotate/force-clear')
 def force_clear_rotation():
     """Force clear stuck rotation state"""
-    global in_progress
-    in_progress = False
-    try:
-        rotate_lock.release()
-    except:
-        pass
+    end_rotation(_rotation["id"])
     return jsonify({'status': 'cleared', 'message': 'Rotation state cleared'})
 
 @app.get('/status/detailed')
@@ -1996,37 +2014,21 @@ def status_detailed():
 
 @app.post('/notify')
 def notify():
-    config = load_config()
-    expected = config['api']['token']
-    token = request.headers.get('Authorization', '')
-    if expected not in token:
-        abort(403)
     current_ip = get_current_ip()
     send_discord_notification(current_ip, is_rotation=False)
     return jsonify({'status': 'notification_sent', 'ip': current_ip})
 
 @app.get('/history')
 def history():
-    config = load_config()
-    expected = config['api']['token']
-    token = request.headers.get('Authorization', '')
-    if expected not in token:
-        abort(403)
     return jsonify(load_ip_history())
 
 @app.post('/test-failure')
 def test_failure():
-    config = load_config()
-    expected = config['api']['token']
-    token = request.headers.get('Authorization', '')
-    if expected not in token:
-        abort(403)
     current_ip = get_current_ip()
     error_msg = request.json.get('error', 'Test failure notification') if request.is_json else 'Test failure notification'
     send_discord_notification(current_ip, is_rotation=False, is_failure=True, error_message=error_msg)
     return jsonify({'status': 'failure_notification_sent', 'ip': current_ip, 'error': error_msg})
 
-@app.get('/auto-rotation/status')
 def auto_rotation_status():
     """Get auto-rotation status and settings."""
     config = load_config()
@@ -2036,47 +2038,36 @@ def auto_rotation_status():
         'enabled': auto_rotation_enabled,
         'interval_seconds': interval,
         'interval_minutes': interval // 60,
-        'thread_alive': bool(auto_rotation_thread and auto_rotation_thread.is_alive())
+        'thread_alive': bool(auto_rotation_thread and auto_rotation_thread.is_alive()),
+        'rotation': rotation_progress()
     })
 
-@app.post('/auto-rotation/enable')
-def auto_rotation_enable():
-    """Enable auto-rotation."""
-    config = load_config()
-    expected = config['api']['token']
-    token = request.headers.get('Authorization', '')
-    if expected not in token:
-        abort(403)
-
-    set_auto_rotation_enabled(True)
-    return jsonify({'status': 'enabled', 'message': 'Auto-rotation enabled'})
-
-@app.post('/auto-rotation/disable')
-def auto_rotation_disable():
-    """Disable auto-rotation."""
-    config = load_config()
-    expected = config['api']['token']
-    token = request.headers.get('Authorization', '')
-    if expected not in token:
-        abort(403)
-
-    set_auto_rotation_enabled(False)
-    return jsonify({'status': 'disabled', 'message': 'Auto-rotation disabled'})
-
-@app.post('/auto-rotation/restart')
 def auto_rotation_restart():
     """Restart auto-rotation thread."""
-    config = load_config()
-    expected = config['api']['token']
-    token = request.headers.get('Authorization', '')
-    if expected not in token:
-        abort(403)
-
     stop_auto_rotation()
     time.sleep(1)
     start_auto_rotation()
     return jsonify({'status': 'restarted', 'message': 'Auto-rotation thread restarted'})
 
+# action -> (HTTP method, handler); everything but status requires the API token
+AUTO_ROTATION_ACTIONS = {
+    'status':  ('GET',  auto_rotation_status),
+    'enable':  ('POST', lambda: (set_auto_rotation_enabled(True),
+                                 jsonify({'status': 'enabled', 'message': 'Auto-rotation enabled'}))[1]),
+    'disable': ('POST', lambda: (set_auto_rotation_enabled(False),
+                                 jsonify({'status': 'disabled', 'message': 'Auto-rotation disabled'}))[1]),
+    'restart': ('POST', auto_rotation_restart),
+}
+
+@app.route('/auto-rotation/<action>', methods=['GET', 'POST'])
+def auto_rotation(action):
+    if action not in AUTO_ROTATION_ACTIONS:
+        abort(404)
+    method, handler = AUTO_ROTATION_ACTIONS[action]
+    if request.method != method:
+        abort(405)
+    return handler()
+
 def run_optimization_in_background():
     """Run optimization in background thread after Flask starts."""
     # Wait for Flask to start
@@ -2125,6 +2116,7 @@ if __name__ == '__main__':
     
     initial_thread = threading.Thread(target=delayed_initial_record, daemon=True)
     initial_thread.start()
+    threading.Thread(target=public_ip_refresher, daemon=True).start()
     if auth_enabled and proxy_user and proxy_pass:
         print(f"🔐 Authentication: {proxy_user}:{proxy_pass}")
         print(f"🧪 curl -x http://{proxy_user}:{proxy_pass}@{lan_ip}:3128 https://api.ipify.org")
@@ -2142,11 +2134,10 @@ if __name__ == '__main__':
     print("   Disable: POST http://127.0.0.1:8088/auto-rotation/disable")
     print("   Restart: POST http://127.0.0.1:8088/auto-rotation/restart")
 
-    webhook_url = config.get('discord', {}).get('webhook_url', '').strip()
-    if webhook_url and webhook_url != "https://discord.com/api/webhooks/YOUR_WEBHOOK_ID/YOUR_TOKEN":
+    if discord_webhook_url():
         print("📱 Discord notifications: Enabled")
-        current_ip = get_current_ip()
-        send_discord_notification(current_ip, is_rotation=True)
+        # IP is looked up by the notify worker so app.run() isn't held up
+        send_discord_notification(None, is_rotation=True)
     else:
         print("📱 Discord notifications: Not configured")
 
@@ -2167,5 +2158,5 @@ if __name__ == '__main__':
         print("   ✅ Optimization thread started (check logs for progress)")
         print()
 
-    app.run(host=config['api']['bind'], port=config['api']['port'])
+    app.run(host=config['api']['bind'], port=config['api']['port'], threaded=True)
 
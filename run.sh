@@ -75,7 +75,7 @@ echo "==> Dependencies…"
 apt-get update -y
 apt-get install -y \
   curl jq iptables iptables-persistent \
-  python3 python3-pip python3-yaml python3-requests python3-serial \
+  python3 python3-pip python3-yaml python3-requests python3-serial gunicorn \
   squid modemmanager ppp libqmi-utils udhcpc isc-dhcp-client
 
 if [[ -z "${NODE_PATH}" ]]; then
@@ -0,0 +1,300 @@
+let refreshInterval;
+
+// Initialize dashboard
+document.addEventListener('DOMContentLoaded', function() {
+    loadData();
+    if (window.EventSource) {
+        subscribeEvents();
+        // Status, connection and auto-rotation state change without a push
+        startPolling(60000);
+    } else {
+        startPolling(30000); // Refresh every 30 seconds
+    }
+});
+
+function startPolling(ms) {
+    clearInterval(refreshInterval);
+    refreshInterval = setInterval(loadData, ms);
+}
+
+// The server pushes the dashboard payload when a rotation lands or the
+// config changes; (re)connecting triggers one full load to resync
+function subscribeEvents() {
+    const events = new EventSource('/api/events');
+    let connected = false;
+    events.onopen = function() {
+        if (connected) {
+            loadData();
+        }
+        connected = true;
+    };
+    events.onmessage = function(ev) {
+        renderDashboard(JSON.parse(ev.data));
+        document.getElementById('last-updated').textContent = new Date().toLocaleString();
+    };
+    events.onerror = function() {
+        // Refused (e.g. 503 when the server is at its stream limit): poll instead
+        if (events.readyState === EventSource.CLOSED) {
+            startPolling(30000);
+        }
+    };
+}
+
+async function loadData() {
+    try {
+        await loadDashboard();
+        document.getElementById('last-updated').textContent = new Date().toLocaleString();
+    } catch (error) {
+        showAlert('Error loading data: ' + error.message, 'error');
+    }
+}
+
+// Status, history, config and auto-rotation arrive together from /api/bundle
+async function loadDashboard() {
+    const response = await fetch('/api/bundle');
+    renderDashboard(await response.json());
+}
+
+function renderDashboard(data) {
+    renderStatus(data.status);
+    renderHistory(data.history);
+    renderConfig(data.config);
+    renderAutoRotation(data.auto_rotation);
+}
+
+function renderStatus(data) {
+    // Display IP with error/warning styling
+    const ipElement = document.getElementById('current-ip');
+    const ip = data.public_ip || 'Unknown';
+    ipElement.textContent = ip;
+
+    // Style IP based on status
+    if (ip.includes('⚠️') || ip.includes('WiFi IP') || ip.includes('LAN IP') || ip.includes('broken')) {
+        ipElement.style.backgroundColor = '#fff3cd';
+        ipElement.style.color = '#856404';
+        ipElement.style.fontWeight = 'bold';
+    } else if (ip === 'No cellular connection' || ip.includes('Error:') || ip.includes('timeout')) {
+        ipElement.style.backgroundColor = '#f8d7da';
+        ipElement.style.color = '#721c24';
+        ipElement.style.fontWeight = 'bold';
+    } else if (ip === 'Rotating...') {
+        ipElement.style.backgroundColor = '#d1ecf1';
+        ipElement.style.color = '#0c5460';
+        ipElement.style.fontWeight = 'bold';
+    } else {
+        ipElement.style.backgroundColor = '#f0f2ff';
+        ipElement.style.color = '#667eea';
+        ipElement.style.fontWeight = 'bold';
+    }
+
+    document.getElementById('connection-status').textContent = data.connected ? 'Connected' : 'Disconnected';
+    document.getElementById('connection-status').className = 'status ' + (data.connected ? 'success' : 'error');
+    document.getElementById('connection-mode').textContent = data.connection_mode || 'Unknown';
+    document.getElementById('interface-name').textContent = data.interface || 'Unknown';
+    document.getElementById('network-type').textContent = data.network_type || 'Unknown';
+
+    // Update IMEI information
+    if (data.imei) {
+        document.getElementById('original-imei').textContent = data.imei.original || 'Not recorded';
+        document.getElementById('current-imei').textContent = data.imei.current || 'Unknown';
+
+        const statusText = document.getElementById('imei-status-text');
+        if (data.imei.spoofed) {
+            statusText.innerHTML = '<span class="status warning">⚠️ IMEI Spoofed</span>';
+        } else if (data.imei.current !== 'Unknown' && data.imei.original !== 'Not recorded') {
+            statusText.innerHTML = '<span class="status success">✅ Original IMEI</span>';
+        } else {
+            statusText.innerHTML = '';
+        }
+    }
+}
+
+function renderHistory(data) {
+    document.getElementById('history-loading').style.display = 'block';
+    document.getElementById('history-content').innerHTML = '';
+
+    document.getElementById('rotation-count').textContent = data.rotations || 0;
+
+    if (data.first_seen) {
+        const firstSeen = new Date(data.first_seen);
+        const uptime = Date.now() - firstSeen.getTime();
+        const hours = Math.floor(uptime / (1000 * 60 * 60));
+        const minutes = Math.floor((uptime % (1000 * 60 * 60)) / (1000 * 60));
+        document.getElementById('uptime').textContent = `${hours}h ${minutes}m`;
+    }
+
+    if (data.ips && data.ips.length > 0) {
+        const lastIP = data.ips[data.ips.length - 1];
+        document.getElementById('last-rotation').textContent = lastIP.date + ' ' + lastIP.time;
+
+        let historyHTML = '';
+        data.ips.slice(-10).reverse().forEach(ip => {
+            const failedClass = ip.failed ? ' style="opacity: 0.7;"' : '';
+            const failedNote = ip.failed ? ' <span style="color: #e74c3c; font-size: 0.85em;">(Failed - Same IP)</span>' : '';
+            historyHTML += `
+                <div class="history-item"${failedClass}>
+                    <span class="history-ip">${ip.ip}${failedNote}</span>
+                    <span class="history-time">${ip.date} ${ip.time}</span>
+                </div>
+            `;
+        });
+        document.getElementById('history-content').innerHTML = historyHTML;
+    } else {
+        document.getElementById('history-content').innerHTML = '<p>No IP history available</p>';
+    }
+
+    document.getElementById('history-loading').style.display = 'none';
+}
+
+function renderConfig(data) {
+    try {
+        if (data.error) {
+            console.error('Config error:', data.error);
+            return;
+        }
+
+        // Update proxy info
+        document.getElementById('proxy-url').textContent = `${data.lan_ip || 'Loading'}:3128`;
+        document.getElementById('api-url').textContent = `127.0.0.1:${data.api_port || '8088'}`;
+
+        // Update configuration display
+        document.getElementById('config-apn').textContent = data.current_apn || 'Auto-detected by run.sh';
+
+        const rotation = data.rotation;
+        if (rotation) {
+            const rotationText = `${rotation.ppp_teardown_wait}s + ${rotation.ppp_restart_wait}s (${rotation.max_attempts} attempts)`;
+            document.getElementById('config-rotation').textContent = rotationText;
+        } else {
+            document.getElementById('config-rotation').textContent = 'N/A';
+        }
+
+        document.getElementById('config-discord').textContent = data.discord?.configured ? '✅ Configured' : '❌ Not configured';
+        document.getElementById('config-auth').textContent = data.proxy?.auth_enabled ? '🔒 Enabled' : '🔓 Disabled';
+    } catch (error) {
+        console.error('Error fetching config:', error);
+    }
+}
+
+async function rotateIP() {
+    const button = event.target;
+    button.disabled = true;
+    button.textContent = '🔄 Rotating...';
+    showAlert('IP rotation started... This may take up to 90 seconds.', 'info');
+
+    try {
+        // Outlast the server's own rotation timeout (300s + 10s read margin)
+        const controller = new AbortController();
+        const timeoutId = setTimeout(() => controller.abort(), 320000);
+
+        const response = await fetch('/api/rotate', { 
+            method: 'POST',
+            signal: controller.signal
+        });
+
+        clearTimeout(timeoutId);
+        const data = await response.json();
+
+        if (data.status === 'success') {
+            showAlert('IP rotation successful!', 'success');
+        } else if (data.status === 'busy') {
+            showAlert('A rotation is already in progress', 'info');
+        } else {
+            showAlert('IP rotation failed: ' + (data.error || 'Unknown error'), 'error');
+        }
+
+        await loadData(); // Refresh all data
+    } catch (error) {
+        if (error.name === 'AbortError') {
+            showAlert('IP rotation timed out. Check logs for status.', 'error');
+        } else {
+            showAlert('Error during rotation: ' + error.message, 'error');
+        }
+    } finally {
+        button.disabled = false;
+        button.textContent = '🔄 Rotate IP';
+    }
+}
+
+async function sendNotification() {
+    const button = event.target;
+    button.disabled = true;
+    button.textContent = '📱 Sending...';
+
+    try {
+        const response = await fetch('/api/notify', { method: 'POST' });
+        const data = await response.json();
+
+        showAlert('Discord notification sent!', 'success');
+    } catch (error) {
+        showAlert('Error sending notification: ' + error.message, 'error');
+    } finally {
+        button.disabled = false;
+        button.textContent = '📱 Send Notification';
+    }
+}
+
+function refreshData() {
+    loadData();
+    showAlert('Data refreshed', 'success');
+}
+
+async function loadAutoRotationStatus() {
+    try {
+        const response = await fetch('/api/auto-rotation/status');
+        renderAutoRotation(await response.json());
+    } catch (error) {
+        console.error('Error loading auto-rotation status:', error);
+    }
+}
+
+function renderAutoRotation(data) {
+    const button = document.getElementById('auto-rotation-toggle');
+    if (data.enabled) {
+        button.textContent = `⚙️ Auto-rotation: ON (${data.interval_minutes}m)`;
+        button.className = 'button success';
+    } else {
+        button.textContent = `⚙️ Auto-rotation: OFF (${data.interval_minutes}m)`;
+        button.className = 'button';
+    }
+}
+
+async function toggleAutoRotation() {
+    try {
+        const response = await fetch('/api/auto-rotation/status');
+        const data = await response.json();
+
+        const endpoint = data.enabled ? '/api/auto-rotation/disable' : '/api/auto-rotation/enable';
+        const action = data.enabled ? 'disable' : 'enable';
+
+        const result = await fetch(endpoint, { method: 'POST' });
+        const resultData = await result.json();
+
+        showAlert(`Auto-rotation ${action}d`, 'success');
+        await loadAutoRotationStatus();
+    } catch (error) {
+        showAlert('Error toggling auto-rotation: ' + error.message, 'error');
+    }
+}
+
+async function restartAutoRotation() {
+    try {
+        const result = await fetch('/api/auto-rotation/restart', { method: 'POST' });
+        const resultData = await result.json();
+
+        showAlert('Auto-rotation restarted', 'success');
+        await loadAutoRotationStatus();
+    } catch (error) {
+        showAlert('Error restarting auto-rotation: ' + error.message, 'error');
+    }
+}
+
+function showAlert(message, type) {
+    const alert = document.getElementById('alert');
+    alert.textContent = message;
+    alert.className = 'alert ' + type;
+    alert.style.display = 'block';
+
+    setTimeout(() => {
+        alert.style.display = 'none';
+    }, 5000);
+}
@@ -7,9 +7,12 @@ Usage: python3 test_discord.py
 import requests
 import yaml
 
+# Reused across the notify and history calls so they share one connection
+session = requests.Session()
+
 def load_config():
     with open('config.yaml', 'r') as f:
-        return yaml.safe_load(f)
+        return yaml.load(f, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
 
 def test_discord_notification():
     """Test Discord notification via API."""
@@ -25,7 +28,7 @@ def test_discord_notification():
     headers = {"Authorization": f"Bearer {api_token}"}
     
     try:
-        response = requests.post(url, headers=headers, timeout=10)
+        response = session.post(url, headers=headers, timeout=10)
         if response.status_code == 200:
             data = response.json()
             print(f"✅ Discord notification sent successfully!")
@@ -57,7 +60,7 @@ def show_ip_history():
     headers = {"Authorization": f"Bearer {api_token}"}
     
     try:
-        response = requests.get(url, headers=headers, timeout=10)
+        response = session.get(url, headers=headers, timeout=10)
         if response.status_code == 200:
             history = response.json()
             print(f"\n📋 IP Rotation History:")
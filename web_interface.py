@@ -5,100 +5,346 @@ Provides a user-friendly dashboard for monitoring and controlling the proxy
 """
 
 import os
-import json
+import fcntl
+import gzip
+import hashlib
+import logging
+import queue
 import requests
+import signal
+import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import yaml
 import socket
-import subprocess
-from datetime import datetime
+import struct
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from flask import Flask, render_template_string, request, jsonify, redirect, url_for
+from flask import Flask, request, jsonify
 
-app = Flask(__name__)
+try:
+    import brotli  # optional: smaller dashboard page for browsers that accept br
+except ImportError:
+    brotli = None
+
+from app_support import install_json_provider, queue_logger
+from app_support import json_dumps as _json_dumps, json_loads as _json_loads
+
+app = Flask(__name__, static_folder='static')
+install_json_provider(app)
+# Request threads only enqueue log records; the listener thread formats and
+# writes them, so a burst of dashboard requests never serialises on stdout.
+# INFO here is the only level gate, under `python web_interface.py` and gunicorn alike
+log = queue_logger("web_interface", logging.INFO)
 
 # Configuration
 CONFIG_FILE = Path(__file__).parent / "config.yaml"
 STATE_DIR = Path(__file__).parent / "state"
-IP_HISTORY_PATH = STATE_DIR / "ip_history.json"
+IP_HISTORY_PATH = STATE_DIR / "ip_history.jsonl"
+HISTORY_KEEP = 10  # entries the dashboard shows
+
+_YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+_CFG_LOCK = threading.Lock()
+def build_safe_config(config):
+    """Static, dashboard-safe part of the config (no tokens or sensitive data)"""
+    webhook_url = (config.get('discord', {}) or {}).get('webhook_url', '') or ''
+    return {
+        'lan_ip': None,       # filled in per request
+        'api_port': config.get('api', {}).get('port', 8088),
+        'current_apn': None,  # filled in per request
+        'rotation': config.get('rotation', {}),
+        # Modem settings are handled by run.sh, not config
+        'proxy': {
+            'auth_enabled': config.get('proxy', {}).get('auth_enabled', False)
+        },
+        'pm2': config.get('pm2', {}),
+        'discord': {
+            'configured': webhook_url.startswith('https://discord.com/api/webhooks/') and
+                          'YOUR_WEBHOOK_ID' not in webhook_url
+        }
+    }
+
+# token, base_url and the safe config are derived once per parse so request
+# handlers don't re-walk the dict
+_CFG_CACHE = {'stamp': None, 'checked': 0.0, 'data': {}, 'token': '', 'base_url': 'http://127.0.0.1:8088',
+              'safe': build_safe_config({})}
+CONFIG_CHECK_SECONDS = 1.0  # how often config.yaml is stat()ed for changes
+
+# JSON mirror of the last parsed config.yaml, tagged with the YAML file's
+# (mtime, size) stamp, so a restart skips the YAML parse when nothing changed.
+# It holds the API token, hence owner-only permissions.
+CONFIG_MIRROR_PATH = STATE_DIR / "config.cache.json"
+
+def read_config_mirror(stamp):
+    """Config dict from the JSON mirror if it matches stamp, else None"""
+    try:
+        mirror = _json_loads(CONFIG_MIRROR_PATH.read_bytes())
+        if mirror.get('stamp') == list(stamp):
+            return mirror['config']
+    except Exception:
+        pass
+    return None
+
+def write_config_mirror(stamp, config):
+    """Best-effort atomic rewrite of the JSON mirror"""
+    tmp = CONFIG_MIRROR_PATH.with_suffix('.tmp')
+    try:
+        body = _json_dumps({'stamp': list(stamp), 'config': config})
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(body)
+        os.replace(tmp, CONFIG_MIRROR_PATH)
+    except Exception as e:
+        log.debug("Config mirror not written: %s", e)
 
 def load_config():
-    """Load configuration from config.yaml"""
+    """Load configuration from config.yaml (re-parsed only when the file changes)"""
+    now = time.monotonic()
+    if now - _CFG_CACHE['checked'] < CONFIG_CHECK_SECONDS:
+        return _CFG_CACHE['data']
     try:
-        with open(CONFIG_FILE, 'r') as f:
-            return yaml.safe_load(f)
+        st = CONFIG_FILE.stat()
+        key = (st.st_mtime_ns, st.st_size)  # size catches same-tick rewrites
+        with _CFG_LOCK:
+            _CFG_CACHE['checked'] = now
+            if key != _CFG_CACHE['stamp']:
+                config = read_config_mirror(key)
+                if config is None:
+                    with open(CONFIG_FILE, 'r') as f:
+                        config = yaml.load(f, Loader=_YamlLoader) or {}
+                    write_config_mirror(key, config)
+                api = config.get('api', {}) or {}
+                _CFG_CACHE.update(
+                    data=config,
+                    token=api.get('token', ''),
+                    base_url=f"http://127.0.0.1:{api.get('port', 8088)}",
+                    safe=build_safe_config(config),
+                    stamp=key,
+                )
+            return _CFG_CACHE['data']
     except:
         return {}
 
+def reload_config(*_):
+    """Force the next load_config() to re-read config.yaml (also the SIGHUP handler)"""
+    # No lock: this can run as a signal handler on a thread that already holds it
+    _CFG_CACHE['stamp'] = None
+    _CFG_CACHE['checked'] = 0.0
+
+# Installed at import so it also holds under gunicorn, whose worker resets
+# its signal handlers before loading web_interface:app. `kill -HUP <worker>`
+# re-reads config.yaml now; a HUP to the gunicorn master restarts the worker,
+# which reads it afresh anyway
+if threading.current_thread() is threading.main_thread():
+    signal.signal(signal.SIGHUP, reload_config)
+
 def get_api_token():
     """Get API token from config"""
-    config = load_config()
-    return config.get('api', {}).get('token', '')
+    load_config()
+    return _CFG_CACHE['token']
 
 def get_api_base_url():
     """Get API base URL"""
-    config = load_config()
-    return f"http://127.0.0.1:{config.get('api', {}).get('port', 8088)}"
+    load_config()
+    return _CFG_CACHE['base_url']
+
+# The LAN address rarely changes, so reuse a detected one for a minute
+# instead of forking `ip` on every config/dashboard request
+LAN_IP_TTL = 60.0
+_LAN_IP_CACHE = {'ip': None, 'ts': 0.0}
 
 def detect_lan_ip():
-    """Detect the actual LAN IP that clients should use"""
-    # Try to get IP from network interfaces first
+    """Detect the actual LAN IP that clients should use (cached for LAN_IP_TTL)"""
+    now = time.monotonic()
+    if _LAN_IP_CACHE['ip'] and now - _LAN_IP_CACHE['ts'] < LAN_IP_TTL:
+        return _LAN_IP_CACHE['ip']
+    ip = _detect_lan_ip()
+    if ip != "127.0.0.1":  # don't pin the "no network yet" answer
+        _LAN_IP_CACHE.update(ip=ip, ts=now)
+    return ip
+
+SIOCGIFADDR = 0x8915
+# One AF_INET socket kept for the life of the process, only used for ioctls
+_IFADDR_SOCK = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+def interface_ip(iface):
+    """IPv4 address of a network interface via SIOCGIFADDR, or None"""
+    try:
+        packed = fcntl.ioctl(_IFADDR_SOCK.fileno(), SIOCGIFADDR,
+                             struct.pack('256s', iface.encode()[:15]))
+        return socket.inet_ntoa(packed[20:24])
+    except OSError:
+        return None  # no such interface or no IPv4 address
+
+def _detect_lan_ip():
+    """Uncached LAN IP lookup"""
+    # Ask the interfaces directly first (a syscall, no `ip` fork)
     for iface in ("wlan0", "eth0"):
-        try:
-            result = subprocess.run(
-                ["ip", "-4", "addr", "show", iface], 
-                capture_output=True, text=True, timeout=5
-            )
-            if result.returncode == 0:
-                for line in result.stdout.split('\n'):
-                    if 'inet ' in line and '127.0.0.1' not in line:
-                        ip = line.split()[1].split('/')[0]
-                        # Skip link-local and private ranges we don't want
-                        if not ip.startswith('169.254.') and not ip.startswith('127.'):
-                            return ip
-        except:
-            continue
+        ip = interface_ip(iface)
+        # Skip link-local and loopback addresses
+        if ip and not ip.startswith('169.254.') and not ip.startswith('127.'):
+            return ip
     
     # Fallback to socket method
     try:
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.connect(("8.8.8.8", 80))
-        ip = s.getsockname()[0]
-        s.close()
-        return ip
-    except:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.connect(("8.8.8.8", 80))
+            return s.getsockname()[0]
+    except OSError:
         return "127.0.0.1"
 
-def api_request(endpoint, method='GET', data=None):
-    """Make authenticated API request"""
-    token = get_api_token()
-    url = f"{get_api_base_url()}{endpoint}"
-    headers = {"Authorization": f"Bearer {token}"}
+# Keep-alive session for the occasional third-party request (direct IP
+# check), so repeated fallbacks reuse the TLS connection
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=2))
+
+# Keep-alive connection pool to the orchestrator API, shared by all requests.
+# Every call goes to the same loopback host, so talk to urllib3 directly and
+# skip requests' per-call session/cookie/hook machinery.
+API_TIMEOUT = urllib3.Timeout(connect=0.5, read=10)
+# POST /rotate answers only once the rotation is over; the orchestrator gives
+# up on one after ROTATION_TIMEOUT_SECONDS (keep in step with orchestrator.py)
+ROTATION_TIMEOUT_SECONDS = 300
+ROTATE_TIMEOUT = urllib3.Timeout(connect=0.5, read=ROTATION_TIMEOUT_SECONDS + 10)
+# Small control-plane requests shouldn't wait on Nagle; keepalive notices a
+# dead orchestrator on idle pooled sockets
+API_SOCKET_OPTIONS = [
+    (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),
+    (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+]
+# Retry refused connects and the orchestrator's transient 502/503/504s.
+# Status retries only apply to idempotent methods, so POST /rotate is never
+# replayed; after the last one the response itself is returned
+API_RETRY = Retry(total=2, backoff_factor=0.1, status_forcelist=(502, 503, 504), raise_on_status=False)
+# Enough idle sockets for every gunicorn thread to keep one across bursts
+API_POOL_SIZE = 8
+_API_POOL_LOCK = threading.Lock()
+_API_POOL = {'key': None, 'pool': None, 'post_headers': {}}
+
+def get_api_pool():
+    """
+    Connection pool for the current API base URL and token, rebuilt only when
+    either changes. The Authorization header lives on the pool (and in the
+    prebuilt POST headers) so calls don't assemble a headers dict each time.
+    """
+    base_url = get_api_base_url()
+    key = (base_url, _CFG_CACHE['token'])
+    with _API_POOL_LOCK:
+        if _API_POOL['key'] != key:
+            if _API_POOL['pool'] is not None:
+                _API_POOL['pool'].close()
+            auth = {'Authorization': f"Bearer {key[1]}"}
+            _API_POOL.update(key=key, post_headers={**auth, 'Content-Type': 'application/json'},
+                             pool=urllib3.connection_from_url(
+                                 base_url, maxsize=API_POOL_SIZE, block=False, headers=auth,
+                                 timeout=API_TIMEOUT, socket_options=API_SOCKET_OPTIONS,
+                                 retries=API_RETRY))
+        return _API_POOL['pool'], _API_POOL['post_headers']
+
+# After a refused/failed connect, answer from this negative cache instead of
+# paying a connect + retry cycle on every poll while the orchestrator restarts
+API_DOWN_BACKOFF = 2.0
+_API_DOWN_UNTIL = 0.0
+
+def api_request(endpoint, method='GET', data=None, timeout=None, statuses=(200,)):
+    """Make authenticated API request
+
+    Returns the decoded body when the status is in `statuses`, else None.
+    `timeout` overrides the pool's API_TIMEOUT for this call.
+    """
+    global _API_DOWN_UNTIL
+    if time.monotonic() < _API_DOWN_UNTIL:
+        return None
+    pool, post_headers = get_api_pool()  # also picks up token/port changes
+    headers = body = None  # GETs use the pool's default headers
+    if method == 'POST':
+        headers = post_headers
+        body = app.json.dumps(data).encode('utf-8')
     
     try:
-        if method == 'POST':
-            response = requests.post(url, headers=headers, json=data, timeout=10)
-        else:
-            response = requests.get(url, headers=headers, timeout=10)
+        response = pool.urlopen(method, endpoint, body=body, headers=headers,
+                                timeout=timeout or API_TIMEOUT)
         
-        print(f"API Request: {method} {url} -> {response.status_code}")
-        if response.status_code == 200:
-            return response.json()
+        log.debug("API Request: %s %s -> %s", method, endpoint, response.status)
+        if response.status in statuses:
+            return _json_loads(response.data)
         else:
-            print(f"API Error: {response.status_code} - {response.text}")
+            log.warning("API Error: %s %s -> %s", method, endpoint, response.status)
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("API Error body: %s", response.data.decode('utf-8', 'replace'))
             return None
+    except urllib3.exceptions.MaxRetryError as e:
+        _API_DOWN_UNTIL = time.monotonic() + API_DOWN_BACKOFF
+        log.warning("API unreachable, backing off %.0fs: %s", API_DOWN_BACKOFF, e.reason)
+        return None
     except Exception as e:
-        print(f"API Request Failed: {e}")
+        log.warning("API Request Failed: %s", e)
         return None
 
+# The orchestrator only appends to ip_history.jsonl (header line, then one
+# entry per line), so keep the tail in memory and read just the new bytes.
+# A different inode or a shorter file means it was compacted: start over.
+_IP_HIST_LOCK = threading.Lock()
+# 'view' is the dict handed to callers, rebuilt only after new lines arrive.
+_IP_HIST_CACHE = {'ino': None, 'offset': 0, 'header': {}, 'lines': 0, 'ips': deque(maxlen=HISTORY_KEEP),
+                  'view': None}
+
+def _parse_history_lines(lines):
+    """Decode ip_history.jsonl lines, skipping any that aren't JSON objects"""
+    recs = []
+    for line in lines:
+        try:
+            rec = _json_loads(line)
+        except ValueError:
+            continue
+        if isinstance(rec, dict):
+            recs.append(rec)
+    return recs
+
 def load_ip_history():
-    """Load IP history"""
+    """IP history from the orchestrator's file (treat as read-only), or None if unreadable"""
     try:
-        if IP_HISTORY_PATH.exists():
-            with open(IP_HISTORY_PATH, 'r') as f:
-                return json.load(f)
+        st = IP_HISTORY_PATH.stat()
+        with _IP_HIST_LOCK:
+            c = _IP_HIST_CACHE
+            if st.st_ino != c['ino'] or st.st_size < c['offset']:
+                c.update(ino=st.st_ino, offset=0, header={}, lines=0, ips=deque(maxlen=HISTORY_KEEP), view=None)
+            if st.st_size > c['offset']:
+                fd = os.open(IP_HISTORY_PATH, os.O_RDONLY)
+                try:
+                    chunk = os.pread(fd, st.st_size - c['offset'], c['offset'])
+                finally:
+                    os.close(fd)
+                chunk = chunk[:chunk.rfind(b'\n') + 1]  # leave a partly written line for next time
+                lines = [line for line in chunk.splitlines() if line.strip()]
+                header = c['header']
+                if c['offset'] == 0 and lines:
+                    first = _parse_history_lines(lines[:1])
+                    if not first or 'ip' not in first[0]:
+                        header = first[0] if first else {}
+                        lines = lines[1:]
+                # Only the shown tail is parsed; older lines just count towards
+                # rotations. Corrupt tail lines are skipped (and not counted),
+                # as the orchestrator does when it loads the file
+                tail = lines[-HISTORY_KEEP:]
+                entries = [rec for rec in _parse_history_lines(tail) if 'ip' in rec]
+                c['header'] = header
+                c['offset'] += len(chunk)
+                c['lines'] += len(lines) - len(tail) + len(entries)
+                c['ips'].extend(entries)
+                c['view'] = None
+            if c['view'] is None:
+                c['view'] = {
+                    'ips': list(c['ips']),
+                    'rotations': max(0, c['header'].get('dropped', 0) + c['lines'] - 1),
+                    'first_seen': c['header'].get('first_seen'),
+                }
+            return c['view']
     except:
-        pass
-    return {"ips": [], "rotations": 0, "first_seen": None}
+        return None
 
 # HTML Template
 HTML_TEMPLATE = """
@@ -108,145 +354,7 @@ HTML_TEMPLATE = """
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>4G Proxy Dashboard</title>
-    <style>
-        * { margin: 0; padding: 0; box-sizing: border-box; }
-        body { 
-            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            min-height: 100vh;
-            padding: 20px;
-        }
-        .container { 
-            max-width: 1200px; 
-            margin: 0 auto; 
-            background: white; 
-            border-radius: 15px; 
-            box-shadow: 0 20px 40px rgba(0,0,0,0.1);
-            overflow: hidden;
-        }
-        .header { 
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            color: white; 
-            padding: 30px; 
-            text-align: center; 
-        }
-        .header h1 { font-size: 2.5em; margin-bottom: 10px; }
-        .header p { opacity: 0.9; font-size: 1.1em; }
-        .content { padding: 30px; }
-        .grid { 
-            display: grid; 
-            grid-template-columns: repeat(auto-fit, minmax(300px, 1fr)); 
-            gap: 20px; 
-            margin-bottom: 30px;
-        }
-        .card { 
-            background: #f8f9fa; 
-            border-radius: 10px; 
-            padding: 25px; 
-            border-left: 4px solid #667eea;
-            transition: transform 0.2s;
-        }
-        .card:hover { transform: translateY(-2px); }
-        .card h3 { 
-            color: #333; 
-            margin-bottom: 15px; 
-            font-size: 1.3em;
-        }
-        .status { 
-            display: inline-block; 
-            padding: 5px 15px; 
-            border-radius: 20px; 
-            font-weight: bold; 
-            font-size: 0.9em;
-        }
-        .status.success { background: #d4edda; color: #155724; }
-        .status.error { background: #f8d7da; color: #721c24; }
-        .status.warning { background: #fff3cd; color: #856404; }
-        .ip-display { 
-            font-family: 'Courier New', monospace; 
-            font-size: 1.2em; 
-            font-weight: bold; 
-            color: #667eea; 
-            background: #f0f2ff; 
-            padding: 10px; 
-            border-radius: 5px; 
-            margin: 10px 0;
-        }
-        .button { 
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            color: white; 
-            border: none; 
-            padding: 12px 25px; 
-            border-radius: 25px; 
-            cursor: pointer; 
-            font-size: 1em; 
-            font-weight: bold;
-            transition: all 0.2s;
-            margin: 5px;
-        }
-        .button:hover { 
-            transform: translateY(-2px); 
-            box-shadow: 0 5px 15px rgba(102, 126, 234, 0.4);
-        }
-        .button:disabled { 
-            opacity: 0.6; 
-            cursor: not-allowed; 
-            transform: none;
-        }
-        .button.danger { 
-            background: linear-gradient(135deg, #e74c3c 0%, #c0392b 100%);
-        }
-        .button.success { 
-            background: linear-gradient(135deg, #27ae60 0%, #229954 100%);
-        }
-        .history-item { 
-            display: flex; 
-            justify-content: space-between; 
-            align-items: center; 
-            padding: 10px; 
-            border-bottom: 1px solid #eee; 
-        }
-        .history-item:last-child { border-bottom: none; }
-        .history-ip { 
-            font-family: 'Courier New', monospace; 
-            font-weight: bold; 
-            color: #667eea;
-        }
-        .history-time { 
-            color: #666; 
-            font-size: 0.9em;
-        }
-        .loading { 
-            display: none; 
-            text-align: center; 
-            padding: 20px;
-        }
-        .spinner { 
-            border: 3px solid #f3f3f3; 
-            border-top: 3px solid #667eea; 
-            border-radius: 50%; 
-            width: 30px; 
-            height: 30px; 
-            animation: spin 1s linear infinite; 
-            margin: 0 auto 10px;
-        }
-        @keyframes spin { 0% { transform: rotate(0deg); } 100% { transform: rotate(360deg); } }
-        .alert { 
-            padding: 15px; 
-            margin: 20px 0; 
-            border-radius: 5px; 
-            display: none;
-        }
-        .alert.success { background: #d4edda; color: #155724; border: 1px solid #c3e6cb; }
-        .alert.error { background: #f8d7da; color: #721c24; border: 1px solid #f5c6cb; }
-        .footer { 
-            text-align: center; 
-            padding: 20px; 
-            color: #666; 
-            border-top: 1px solid #eee; 
-            margin-top: 30px;
-        }
-    </style>
+    <link rel="stylesheet" href="/static/dashboard.css?v={css_v}">
 </head>
 <body>
     <div class="container">
@@ -344,349 +452,355 @@ HTML_TEMPLATE = """
         </div>
     </div>
 
-    <script>
-        let refreshInterval;
-        
-        // Initialize dashboard
-        document.addEventListener('DOMContentLoaded', function() {
-            loadData();
-            refreshInterval = setInterval(loadData, 30000); // Refresh every 30 seconds
-        });
-        
-        async function loadData() {
-            try {
-                await Promise.all([
-                    loadStatus(),
-                    loadHistory(),
-                    loadConfig(),
-                    loadAutoRotationStatus()
-                ]);
-                document.getElementById('last-updated').textContent = new Date().toLocaleString();
-            } catch (error) {
-                showAlert('Error loading data: ' + error.message, 'error');
-            }
-        }
-        
-        async function loadStatus() {
-            const response = await fetch('/api/status');
-            const data = await response.json();
-            
-            // Display IP with error/warning styling
-            const ipElement = document.getElementById('current-ip');
-            const ip = data.public_ip || 'Unknown';
-            ipElement.textContent = ip;
-            
-            // Style IP based on status
-            if (ip.includes('⚠️') || ip.includes('WiFi IP') || ip.includes('LAN IP') || ip.includes('broken')) {
-                ipElement.style.backgroundColor = '#fff3cd';
-                ipElement.style.color = '#856404';
-                ipElement.style.fontWeight = 'bold';
-            } else if (ip === 'No cellular connection' || ip.includes('Error:') || ip.includes('timeout')) {
-                ipElement.style.backgroundColor = '#f8d7da';
-                ipElement.style.color = '#721c24';
-                ipElement.style.fontWeight = 'bold';
-            } else if (ip === 'Rotating...') {
-                ipElement.style.backgroundColor = '#d1ecf1';
-                ipElement.style.color = '#0c5460';
-                ipElement.style.fontWeight = 'bold';
-            } else {
-                ipElement.style.backgroundColor = '#f0f2ff';
-                ipElement.style.color = '#667eea';
-                ipElement.style.fontWeight = 'bold';
-            }
-            
-            document.getElementById('connection-status').textContent = data.connected ? 'Connected' : 'Disconnected';
-            document.getElementById('connection-status').className = 'status ' + (data.connected ? 'success' : 'error');
-            document.getElementById('connection-mode').textContent = data.connection_mode || 'Unknown';
-            document.getElementById('interface-name').textContent = data.interface || 'Unknown';
-            document.getElementById('network-type').textContent = data.network_type || 'Unknown';
-            
-            // Update IMEI information
-            if (data.imei) {
-                document.getElementById('original-imei').textContent = data.imei.original || 'Not recorded';
-                document.getElementById('current-imei').textContent = data.imei.current || 'Unknown';
-                
-                const statusText = document.getElementById('imei-status-text');
-                if (data.imei.spoofed) {
-                    statusText.innerHTML = '<span class="status warning">⚠️ IMEI Spoofed</span>';
-                } else if (data.imei.current !== 'Unknown' && data.imei.original !== 'Not recorded') {
-                    statusText.innerHTML = '<span class="status success">✅ Original IMEI</span>';
-                } else {
-                    statusText.innerHTML = '';
-                }
-            }
-        }
-        
-        async function loadHistory() {
-            document.getElementById('history-loading').style.display = 'block';
-            document.getElementById('history-content').innerHTML = '';
-            
-            const response = await fetch('/api/history');
-            const data = await response.json();
-            
-            document.getElementById('rotation-count').textContent = data.rotations || 0;
-            
-            if (data.first_seen) {
-                const firstSeen = new Date(data.first_seen);
-                const uptime = Date.now() - firstSeen.getTime();
-                const hours = Math.floor(uptime / (1000 * 60 * 60));
-                const minutes = Math.floor((uptime % (1000 * 60 * 60)) / (1000 * 60));
-                document.getElementById('uptime').textContent = `${hours}h ${minutes}m`;
-            }
-            
-            if (data.ips && data.ips.length > 0) {
-                const lastIP = data.ips[data.ips.length - 1];
-                document.getElementById('last-rotation').textContent = lastIP.date + ' ' + lastIP.time;
-                
-                let historyHTML = '';
-                data.ips.slice(-10).reverse().forEach(ip => {
-                    const failedClass = ip.failed ? ' style="opacity: 0.7;"' : '';
-                    const failedNote = ip.failed ? ' <span style="color: #e74c3c; font-size: 0.85em;">(Failed - Same IP)</span>' : '';
-                    historyHTML += `
-                        <div class="history-item"${failedClass}>
-                            <span class="history-ip">${ip.ip}${failedNote}</span>
-                            <span class="history-time">${ip.date} ${ip.time}</span>
-                        </div>
-                    `;
-                });
-                document.getElementById('history-content').innerHTML = historyHTML;
-            } else {
-                document.getElementById('history-content').innerHTML = '<p>No IP history available</p>';
-            }
-            
-            document.getElementById('history-loading').style.display = 'none';
-        }
-        
-        async function loadConfig() {
-            try {
-                const response = await fetch('/api/config');
-                const data = await response.json();
-                
-                if (data.error) {
-                    console.error('Config error:', data.error);
-                    return;
-                }
-
-                // Update proxy info
-                document.getElementById('proxy-url').textContent = `${data.lan_ip || 'Loading'}:3128`;
-                document.getElementById('api-url').textContent = `127.0.0.1:${data.api_port || '8088'}`;
-                
-                // Update configuration display
-                document.getElementById('config-apn').textContent = data.current_apn || 'Auto-detected by run.sh';
-                
-                const rotation = data.rotation;
-                if (rotation) {
-                    const rotationText = `${rotation.ppp_teardown_wait}s + ${rotation.ppp_restart_wait}s (${rotation.max_attempts} attempts)`;
-                    document.getElementById('config-rotation').textContent = rotationText;
-                } else {
-                    document.getElementById('config-rotation').textContent = 'N/A';
-                }
-
-                document.getElementById('config-discord').textContent = data.discord?.configured ? '✅ Configured' : '❌ Not configured';
-                document.getElementById('config-auth').textContent = data.proxy?.auth_enabled ? '🔒 Enabled' : '🔓 Disabled';
-            } catch (error) {
-                console.error('Error fetching config:', error);
-            }
-        }
-        
-        async function rotateIP() {
-            const button = event.target;
-            button.disabled = true;
-            button.textContent = '🔄 Rotating...';
-            showAlert('IP rotation started... This may take up to 90 seconds.', 'info');
-            
-            try {
-                // Use a longer timeout for rotation (90 seconds + buffer)
-                const controller = new AbortController();
-                const timeoutId = setTimeout(() => controller.abort(), 95000);
-                
-                const response = await fetch('/api/rotate', { 
-                    method: 'POST',
-                    signal: controller.signal
-                });
-                
-                clearTimeout(timeoutId);
-                const data = await response.json();
-                
-                if (data.status === 'success') {
-                    showAlert('IP rotation successful!', 'success');
-                } else {
-                    showAlert('IP rotation failed: ' + (data.error || 'Unknown error'), 'error');
-                }
-                
-                await loadData(); // Refresh all data
-            } catch (error) {
-                if (error.name === 'AbortError') {
-                    showAlert('IP rotation timed out. Check logs for status.', 'error');
-                } else {
-                    showAlert('Error during rotation: ' + error.message, 'error');
-                }
-            } finally {
-                button.disabled = false;
-                button.textContent = '🔄 Rotate IP';
-            }
-        }
-        
-        async function sendNotification() {
-            const button = event.target;
-            button.disabled = true;
-            button.textContent = '📱 Sending...';
-            
-            try {
-                const response = await fetch('/api/notify', { method: 'POST' });
-                const data = await response.json();
-                
-                showAlert('Discord notification sent!', 'success');
-            } catch (error) {
-                showAlert('Error sending notification: ' + error.message, 'error');
-            } finally {
-                button.disabled = false;
-                button.textContent = '📱 Send Notification';
-            }
-        }
-        
-        function refreshData() {
-            loadData();
-            showAlert('Data refreshed', 'success');
-        }
-        
-        async function loadAutoRotationStatus() {
-            try {
-                const response = await fetch('/api/auto-rotation/status');
-                const data = await response.json();
-                
-                const button = document.getElementById('auto-rotation-toggle');
-                if (data.enabled) {
-                    button.textContent = `⚙️ Auto-rotation: ON (${data.interval_minutes}m)`;
-                    button.className = 'button success';
-                } else {
-                    button.textContent = `⚙️ Auto-rotation: OFF (${data.interval_minutes}m)`;
-                    button.className = 'button';
-                }
-            } catch (error) {
-                console.error('Error loading auto-rotation status:', error);
-            }
-        }
-        
-        async function toggleAutoRotation() {
-            try {
-                const response = await fetch('/api/auto-rotation/status');
-                const data = await response.json();
-                
-                const endpoint = data.enabled ? '/api/auto-rotation/disable' : '/api/auto-rotation/enable';
-                const action = data.enabled ? 'disable' : 'enable';
-                
-                const result = await fetch(endpoint, { method: 'POST' });
-                const resultData = await result.json();
-                
-                showAlert(`Auto-rotation ${action}d`, 'success');
-                await loadAutoRotationStatus();
-            } catch (error) {
-                showAlert('Error toggling auto-rotation: ' + error.message, 'error');
-            }
-        }
-        
-        async function restartAutoRotation() {
-            try {
-                const result = await fetch('/api/auto-rotation/restart', { method: 'POST' });
-                const resultData = await result.json();
-                
-                showAlert('Auto-rotation restarted', 'success');
-                await loadAutoRotationStatus();
-            } catch (error) {
-                showAlert('Error restarting auto-rotation: ' + error.message, 'error');
-            }
-        }
-
-        function showAlert(message, type) {
-            const alert = document.getElementById('alert');
-            alert.textContent = message;
-            alert.className = 'alert ' + type;
-            alert.style.display = 'block';
-            
-            setTimeout(() => {
-                alert.style.display = 'none';
-            }, 5000);
-        }
-    </script>
+    <script src="/static/dashboard.js?v={js_v}"></script>
 </body>
 </html>
 """
 
+STATIC_DIR = Path(__file__).parent / "static"
+STATIC_MAX_AGE = 31536000  # asset URLs carry a content hash, so they never go stale
+
+def asset_version(name):
+    """Short content hash used as the cache-busting query string for a static asset"""
+    return hashlib.sha1((STATIC_DIR / name).read_bytes()).hexdigest()[:10]
+
+# The dashboard shell only needs the asset hashes filled in, so build and
+# encode it once instead of running it through Jinja on every page load
+_DASHBOARD_HTML = (HTML_TEMPLATE
+                   .replace('{css_v}', asset_version('dashboard.css'))
+                   .replace('{js_v}', asset_version('dashboard.js'))
+                   .encode('utf-8'))
+# The shell only changes on deploy (asset URLs carry their own hashes). The
+# ETag is weak so one validator covers every Content-Encoding of the page.
+_DASHBOARD_ETAG = hashlib.blake2s(_DASHBOARD_HTML, digest_size=8).hexdigest()
+_DASHBOARD_HEADERS = {'Cache-Control': 'public, max-age=300', 'Vary': 'Accept-Encoding',
+                      'ETag': f'W/"{_DASHBOARD_ETAG}"'}
+
+# Pre-compressed variants, best first: (encoding, body)
+_DASHBOARD_ENCODED = [('gzip', gzip.compress(_DASHBOARD_HTML, compresslevel=9))]
+if brotli is not None:
+    _DASHBOARD_ENCODED.insert(0, ('br', brotli.compress(_DASHBOARD_HTML)))
+
+@app.after_request
+def cache_static_assets(response):
+    """Let browsers keep versioned dashboard assets without revalidating"""
+    if request.endpoint == 'static' and request.args.get('v') and response.status_code == 200:
+        response.headers['Cache-Control'] = f'public, max-age={STATIC_MAX_AGE}, immutable'
+    return response
+
 @app.route('/')
 def dashboard():
     """Main dashboard page"""
-    return render_template_string(HTML_TEMPLATE)
+    if request.if_none_match.contains_weak(_DASHBOARD_ETAG):
+        return app.response_class(status=304, headers=_DASHBOARD_HEADERS)
+    for encoding, body in _DASHBOARD_ENCODED:
+        if request.accept_encodings.quality(encoding) > 0:
+            return app.response_class(body, mimetype='text/html',
+                                      headers={**_DASHBOARD_HEADERS, 'Content-Encoding': encoding})
+    return app.response_class(_DASHBOARD_HTML, mimetype='text/html', headers=_DASHBOARD_HEADERS)
 
-@app.route('/api/status')
-def api_status():
-    """Get current proxy status"""
+DIRECT_IP_TTL = 5.0  # coalesces bursts of fallback lookups
+_DIRECT_IP_CACHE = {'ip': None, 'ts': 0.0}
+
+def direct_public_ip():
+    """Public IP from icanhazip when the API is down (cached briefly), or None"""
+    now = time.monotonic()
+    if _DIRECT_IP_CACHE['ip'] and now - _DIRECT_IP_CACHE['ts'] < DIRECT_IP_TTL:
+        return _DIRECT_IP_CACHE['ip']
+    try:
+        response = _SESSION.get('https://ipv4.icanhazip.com', timeout=5)
+        if response.ok:
+            ip = response.text.strip()
+            _DIRECT_IP_CACHE.update(ip=ip, ts=now)
+            return ip
+    except requests.RequestException:
+        pass
+    return None
+
+# /status backs /api/status, the APN in /api/config and the bundle; a short
+# TTL lets them share one upstream call per refresh
+STATUS_TTL = 2.0
+_STATUS_CACHE = (0.0, None)  # (fetched_at, data), swapped as a whole
+
+def api_status_cached():
+    """The API's /status response, reused for STATUS_TTL seconds"""
+    global _STATUS_CACHE
+    fetched_at, data = _STATUS_CACHE
+    now = time.monotonic()
+    if data and now - fetched_at < STATUS_TTL:
+        return data
     data = api_request('/status')
     if data:
-        return jsonify(data)
+        _STATUS_CACHE = (now, data)
+    return data
+
+def invalidate_status():
+    """Drop cached status/config answers after an action that changes them"""
+    global _STATUS_CACHE, _SAFE_CFG_BODY
+    _STATUS_CACHE = (0.0, None)
+    _SAFE_CFG_BODY = (None, b'', '', 0.0)
+
+def get_status():
+    """Current proxy status as (data, http_status)"""
+    data = api_status_cached()
+    if data:
+        return data, 200
     
     # Try to get IP directly if API fails
-    try:
-        import subprocess
-        result = subprocess.run(['curl', '-s', 'https://ipv4.icanhazip.com'], 
-                              capture_output=True, text=True, timeout=5)
-        if result.returncode == 0:
-            ip = result.stdout.strip()
-            return jsonify({'public_ip': ip, 'error': 'API unavailable, using direct IP check'})
-    except:
-        pass
+    ip = direct_public_ip()
+    if ip:
+        return {'public_ip': ip, 'error': 'API unavailable, using direct IP check'}, 200
     
-    return jsonify({'public_ip': 'Unknown', 'error': 'API unavailable and direct IP check failed'}), 500
+    return {'public_ip': 'Unknown', 'error': 'API unavailable and direct IP check failed'}, 500
 
-@app.route('/api/config')
-def api_config():
-    """Get current configuration settings"""
+def get_history():
+    """IP rotation history as (data, http_status)"""
+    # The orchestrator's /history serves this same file, so read it directly
+    # and skip the API round trip; the API is only the fallback
+    history = load_ip_history()
+    if history is not None:
+        return history, 200
+
+    data = api_request('/history')
+    if data:
+        # Only ship what the dashboard renders
+        ips = data.get('ips') or []
+        return {
+            'ips': ips[-HISTORY_KEEP:],
+            'rotations': data.get('rotations', 0),
+            'first_seen': data.get('first_seen'),
+            'total': len(ips),
+        }, 200
+    return {'ips': [], 'rotations': 0, 'error': 'History file unreadable and API unavailable'}, 500
+
+def get_auto_rotation_status():
+    """Auto-rotation state as (data, http_status)"""
+    data = api_request('/auto-rotation/status')
+    if data:
+        return data, 200
+    return {'enabled': False, 'interval_seconds': 0, 'interval_minutes': 0, 'error': 'API unavailable'}, 500
+
+def get_safe_config(status_data=None, lan_ip=None):
+    """Dashboard-safe configuration as (data, http_status); reuses status_data/lan_ip if given"""
     try:
-        config = load_config()
+        load_config()
         
         # Get current APN from orchestrator API
         current_apn = "Auto-detected by run.sh"
         try:
-            status_data = api_request('/status')
+            if status_data is None:
+                status_data = api_status_cached()
             if status_data and 'pdp' in status_data and status_data['pdp']:
                 current_apn = f"{status_data['pdp']} (auto-detected)"
         except:
             pass
         
-        # Only return safe config values (no tokens or sensitive data)
-        safe_config = {
-            'lan_ip': detect_lan_ip(),  # Use detected LAN IP instead of config
-            'api_port': config.get('api', {}).get('port', 8088),
-            'current_apn': current_apn,
-            'rotation': config.get('rotation', {}),
-            # Modem settings are handled by run.sh, not config
-            'proxy': {
-                'auth_enabled': config.get('proxy', {}).get('auth_enabled', False)
-            },
-            'pm2': config.get('pm2', {}),
-            'discord': {
-                'configured': bool(config.get('discord', {}).get('webhook_url', '').startswith('https://discord.com/api/webhooks/') and 
-                                 'YOUR_WEBHOOK_ID' not in config.get('discord', {}).get('webhook_url', ''))
-            }
-        }
+        # Only the live values change between config reloads
+        safe_config = dict(_CFG_CACHE['safe'])
+        safe_config['lan_ip'] = lan_ip or detect_lan_ip()  # Use detected LAN IP instead of config
+        safe_config['current_apn'] = current_apn
         
-        return jsonify(safe_config)
+        return safe_config, 200
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return {'error': str(e)}, 500
+
+@app.route('/api/status')
+def api_status():
+    """Get current proxy status"""
+    data, code = get_status()
+    return jsonify(data), code
+
+def conditional_json(data, code=200, etag=None):
+    """
+    JSON response that answers If-None-Match with a bodiless 304. Uses the
+    given etag, or a hash of the body when none is given.
+    """
+    response = jsonify(data)
+    response.status_code = code
+    if code == 200:
+        response.headers['Cache-Control'] = 'no-cache'  # always revalidate
+        if etag:
+            response.set_etag(etag, weak=True)
+        else:
+            response.add_etag(weak=True)
+        response.make_conditional(request)
+    return response
+
+def history_etag():
+    """Validator for the orchestrator's history file, or None if it can't be read"""
+    try:
+        st = IP_HISTORY_PATH.stat()
+        return f"h{st.st_ino:x}-{st.st_mtime_ns:x}-{st.st_size:x}"
+    except OSError:
+        return None
+
+# Serialised /api/config body and its ETag, reused until config.yaml or one
+# of the live values (lan_ip, current_apn) changes; within CONFIG_RESPONSE_TTL
+# of the last build it is served without looking at the inputs at all
+CONFIG_RESPONSE_TTL = 5.0
+_SAFE_CFG_BODY = (None, b'', '', 0.0)  # (key, body, etag, built_at), swapped as a whole
+
+@app.route('/api/config')
+def api_config():
+    """Get current configuration settings"""
+    global _SAFE_CFG_BODY
+    now = time.monotonic()
+    if _SAFE_CFG_BODY[0] is None or now - _SAFE_CFG_BODY[3] >= CONFIG_RESPONSE_TTL:
+        data, code = get_safe_config()
+        if code != 200:
+            return conditional_json(data, code)
+        key = (_CFG_CACHE['stamp'], data['lan_ip'], data['current_apn'])
+        if _SAFE_CFG_BODY[0] != key:
+            body = app.json.dumps(data).encode('utf-8')
+            _SAFE_CFG_BODY = (key, body, hashlib.sha1(body).hexdigest(), now)
+        else:
+            _SAFE_CFG_BODY = _SAFE_CFG_BODY[:3] + (now,)
+    _, body, etag, _ = _SAFE_CFG_BODY
+    response = app.response_class(body, mimetype='application/json',
+                                  headers={'Cache-Control': 'no-cache'})
+    response.set_etag(etag, weak=True)
+    return response.make_conditional(request)
 
 @app.route('/api/history')
 def api_history():
     """Get IP rotation history"""
-    data = api_request('/history')
-    if data:
-        return jsonify(data)
-    return jsonify({'ips': [], 'rotations': 0, 'error': 'API unavailable'}), 500
+    # History only changes when the orchestrator appends to its file, so an
+    # unchanged file answers 304 without asking the API at all
+    etag = history_etag()
+    if etag and request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag, weak=True)
+        return response
+    data, code = get_history()
+    return conditional_json(data, code, etag)
+
+_DASHBOARD_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="dashboard")
+
+def get_dashboard():
+    """Status, history, config and auto-rotation state for the dashboard as one dict"""
+    # Only the two API calls wait on the network; history (local file) and
+    # the LAN IP (cached ioctl) are cheap enough to run inline meanwhile
+    status_future = _DASHBOARD_POOL.submit(get_status)
+    auto_future = _DASHBOARD_POOL.submit(get_auto_rotation_status)
+    history, _ = get_history()
+    lan_ip = detect_lan_ip()
+    status, _ = status_future.result()
+    # The API's /status already carries the PDP address config needs
+    config, _ = get_safe_config(status if 'error' not in status else {}, lan_ip)
+    auto_rotation, _ = auto_future.result()
+    return {'status': status, 'history': history, 'config': config, 'auto_rotation': auto_rotation}
 
+@app.route('/api/bundle')
+@app.route('/api/dashboard')
+def api_dashboard():
+    """Everything the dashboard shows in one round trip"""
+    return conditional_json(get_dashboard())
+
+# ========= Server-Sent Events =========
+# One watcher thread stats the history file and config.yaml and, when either
+# changes (a rotation finished, config edited), builds the dashboard payload
+# once and hands it to every connected /api/events stream. Each stream holds a
+# server thread for as long as it is open, so only a few are allowed; the
+# rest get 503 and the page falls back to polling.
+EVENT_POLL_SECONDS = 1.0
+EVENT_MAX_SUBSCRIBERS = 2  # of the 8 worker threads, leave room for API calls
+EVENT_KEEPALIVE_SECONDS = 15.0
+_EVENT_LOCK = threading.Lock()
+_EVENT_SUBSCRIBERS = set()
+_EVENT_WATCHER = None
+
+def events_signature():
+    """Cheap change marker for everything an event would report"""
+    try:
+        st = CONFIG_FILE.stat()
+        cfg_stamp = (st.st_mtime_ns, st.st_size)
+    except OSError:
+        cfg_stamp = None
+    return history_etag(), cfg_stamp
+
+def events_watcher():
+    """Push a fresh dashboard payload to subscribers whenever the signature changes"""
+    last = events_signature()
+    while True:
+        time.sleep(EVENT_POLL_SECONDS)
+        with _EVENT_LOCK:
+            subscribers = list(_EVENT_SUBSCRIBERS)
+        if not subscribers:
+            last = None  # resync on the next subscriber without a stale push
+            continue
+        current = events_signature()
+        if last is None or current == last:
+            last = current
+            continue
+        last = current
+        try:
+            message = f"data: {app.json.dumps(get_dashboard())}\n\n"
+        except Exception as e:
+            log.warning("Event payload failed: %s", e)
+            continue
+        for q in subscribers:
+            try:
+                q.put_nowait(message)
+            except queue.Full:
+                pass  # slow client; it still gets the next one
+
+def events_subscribe():
+    """Register a new stream (None when at the limit), starting the watcher on first use"""
+    global _EVENT_WATCHER
+    q = queue.Queue(maxsize=4)
+    with _EVENT_LOCK:
+        if len(_EVENT_SUBSCRIBERS) >= EVENT_MAX_SUBSCRIBERS:
+            return None
+        _EVENT_SUBSCRIBERS.add(q)
+        if _EVENT_WATCHER is None:
+            _EVENT_WATCHER = threading.Thread(target=events_watcher, name="events", daemon=True)
+            _EVENT_WATCHER.start()
+    return q
+
+def events_unsubscribe(q):
+    with _EVENT_LOCK:
+        _EVENT_SUBSCRIBERS.discard(q)
+
+@app.route('/api/events')
+def api_events():
+    """Stream dashboard updates as they happen instead of being polled"""
+    q = events_subscribe()
+    if q is None:
+        return jsonify({'error': 'Too many event streams, poll /api/bundle instead'}), 503
+
+    def stream():
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    yield q.get(timeout=EVENT_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"  # also detects closed connections
+        finally:
+            events_unsubscribe(q)
+
+    return app.response_class(stream(), mimetype='text/event-stream',
+                              headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+# A rotation ties up a worker thread for up to ROTATION_TIMEOUT_SECONDS; a
+# second click (or a second dashboard) gets an immediate 429 instead of
+# queueing another one
+_ROTATE_LOCK = threading.Lock()
 
 @app.route('/api/rotate', methods=['POST'])
 def api_rotate():
     """Trigger IP rotation"""
-    data = api_request('/rotate', method='POST')
+    if not _ROTATE_LOCK.acquire(blocking=False):
+        return jsonify({'status': 'busy', 'error': 'A rotation is already in progress'}), 429
+    try:
+        # 429 means a rotation started elsewhere (auto-rotation, another client)
+        data = api_request('/rotate', method='POST', timeout=ROTATE_TIMEOUT, statuses=(200, 429))
+    finally:
+        _ROTATE_LOCK.release()
+    invalidate_status()
+    if data and data.get('status') == 'busy':
+        return jsonify(data), 429
     if data:
         return jsonify(data)
     return jsonify({'status': 'failed', 'error': 'API unavailable'}), 500
@@ -702,10 +816,8 @@ def api_notify():
 @app.route('/api/auto-rotation/status')
 def api_auto_rotation_status():
     """Get auto-rotation status"""
-    data = api_request('/auto-rotation/status')
-    if data:
-        return jsonify(data)
-    return jsonify({'enabled': False, 'interval_seconds': 0, 'interval_minutes': 0, 'error': 'API unavailable'}), 500
+    data, code = get_auto_rotation_status()
+    return jsonify(data), code
 
 @app.route('/api/auto-rotation/enable', methods=['POST'])
 def api_auto_rotation_enable():
@@ -739,4 +851,14 @@ if __name__ == '__main__':
     # Get LAN IP for display
     lan_ip = detect_lan_ip()
     
-    app.run(host='0.0.0.0', port=5000, debug=False)
+    try:
+        from waitress import serve  # optional production server
+    except ImportError:
+        serve = None
+
+    if serve is not None:
+        # Worker thread pool so the dashboard's parallel fetches and the
+        # upstream API fan-out overlap; keep-alive connections are reused
+        serve(app, host='0.0.0.0', port=5000, threads=8, connection_limit=64, channel_timeout=30)
+    else:
+        app.run(host='0.0.0.0', port=5000, debug=False, threaded=True)